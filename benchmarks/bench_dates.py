@@ -0,0 +1,67 @@
+"""
+Micro-benchmark for date parsing in djanx.forms.DateField and
+djanx.utils.dict_to_model: the ISO 8601 fast path against the lenient
+dateutil parser it replaced, on a formset with many date columns.
+
+    PYTHONPATH=. python benchmarks/bench_dates.py [rows] [columns]
+"""
+import sys, timeit
+
+import django
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(USE_TZ=True, USE_I18N=False)
+    django.setup()
+
+import dateutil.parser
+from django import forms
+from django.forms import formset_factory
+
+from djanx.forms import DateField, DjanxFormSetMixin
+from djanx.utils import parse_iso_datetime
+
+class DateutilDateField(forms.DateField):
+    """ DateField as it was before the fast path """
+    def strptime(self, value, format):
+        return dateutil.parser.parse(value).date()
+
+def make_formset(field_class, columns):
+    attrs = {'d%d' % i: field_class() for i in range(columns)}
+    form = type('DatesForm', (forms.Form,), attrs)
+    return formset_factory(form, formset=type('DatesFormSet', 
+        (DjanxFormSetMixin, forms.BaseFormSet), {}))
+
+def make_rows(rows, columns):
+    # Alternate the two shapes the frontend sends
+    return [{'d%d' % i: ('2017-%02d-%02dT10:30:00.000Z' if (r + i) % 2 else '2017-%02d-%02d') 
+                % (1 + i % 12, 1 + r % 28) 
+            for i in range(columns)} 
+        for r in range(rows)]
+
+def bench(label, fn, number):
+    best = min(timeit.repeat(fn, number=number, repeat=5)) / number
+    print('%-40s %10.3f ms' % (label, best * 1000))
+    return best
+
+def main(rows=200, columns=10):
+    data = make_rows(rows, columns)
+    values = [v for row in data for v in row.values()]
+
+    print('%d rows x %d date columns (%d values)' % (rows, columns, len(values)))
+    slow = bench('dateutil.parser.parse', lambda: [dateutil.parser.parse(v) for v in values], 10)
+    fast = bench('parse_iso_datetime', lambda: [parse_iso_datetime(v) for v in values], 10)
+    print('%-40s %10.1fx' % ('speedup', slow / fast))
+
+    def clean(field_class):
+        formset = make_formset(field_class, columns)
+        def run():
+            fs = formset.from_json(data)
+            assert fs.is_valid(), fs.errors
+        return run
+    slow = bench('formset clean, dateutil', clean(DateutilDateField), 3)
+    fast = bench('formset clean, ISO fast path', clean(DateField), 3)
+    print('%-40s %10.1fx' % ('speedup', slow / fast))
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
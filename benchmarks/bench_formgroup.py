@@ -0,0 +1,322 @@
+"""
+Benchmarks FormGroup.serialize, deserialize, is_valid and save on an
+in-memory SQLite database, over a grid of formset row counts, formset field
+counts and choice-field cardinalities.
+
+Two groups are measured:
+
+    fixture: the test models (TestMainModel with a TestOneToOneModel and a
+    formset of TestRelatedModel rows).  Only the row count varies.
+
+    wide: synthetic models whose formset rows have the given number of
+    fields (text, integer, decimal, date and boolean in turn) plus a foreign
+    key to a model with the given number of choices.
+
+For each stage the best wall time of --repeat runs, the query count and the
+peak memory allocated (tracemalloc, measured in a separate run) are written
+as one JSON object per line, to stdout or --output.  Pass an earlier output
+file as --compare to print the time and query ratios against it.
+
+    PYTHONPATH=. python benchmarks/bench_formgroup.py --rows 10,100,1000,10000
+    PYTHONPATH=. python benchmarks/bench_formgroup.py --output new.jsonl --compare old.jsonl
+"""
+import argparse, datetime, decimal, gc, json, platform, sys, tracemalloc
+
+import django
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+        INSTALLED_APPS=['django.contrib.contenttypes', 'djanx'],
+        USE_TZ=True, USE_I18N=False)
+    django.setup()
+
+from django import forms
+from django.db import connection, models, reset_queries, transaction
+from django.forms import modelform_factory, inlineformset_factory
+
+from djanx.form_group import FormGroup
+from djanx.forms import DjanxForm, DjanxInlineFormSet
+from djanx.instrumentation import Instrument
+from djanx.models import TestMainModel, TestOneToOneModel, TestRelatedModel
+from djanx import codec
+
+MAX_ROWS = 100000
+
+STAGES = ['get_object', 'serialize', 'encode', 'deserialize', 'is_valid', 'save', 'save_bulk']
+
+class BenchForm(DjanxForm, forms.ModelForm):
+    pass
+
+def make_form(model, fields):
+    return modelform_factory(model, form=BenchForm, fields=fields)
+
+def make_formset(parent, model, fields):
+    # max_num above the largest row count; Django's default caps formsets at 1000 forms
+    return inlineformset_factory(parent, model, form=make_form(model, fields), fields=fields,
+            formset=DjanxInlineFormSet, can_delete=True, extra=0, max_num=MAX_ROWS)
+
+def create_tables(*models):
+    with connection.schema_editor() as editor:
+        for model in models:
+            editor.create_model(model)
+
+class Group(object):
+    """
+    A FormGroup's arguments, its object and how to change a formset row.
+    serialize_kwargs replace kwargs for serializing: serialize wants
+    one-to-one form instances where deserialize wants classes.
+    """
+
+    def __init__(self, params, kwargs, obj, change_row, serialize_kwargs={}):
+        self.params = params
+        self.kwargs = kwargs
+        self.serialize_kwargs = serialize_kwargs
+        self.obj = obj
+        self.change_row = change_row
+
+    def form_group(self, serializing=False, **kwargs):
+        kwargs.update(self.kwargs)
+        if serializing:
+            kwargs.update(self.serialize_kwargs)
+        return FormGroup(**kwargs)
+
+def fixture_group(rows):
+    o2o = TestOneToOneModel.objects.create(bar='BAR')
+    obj = TestMainModel.objects.create(foo='FOO', o2o=o2o)
+    TestRelatedModel.objects.bulk_create(
+            [TestRelatedModel(main_model=obj, baz='BAZ %d' % i) for i in range(rows)])
+
+    def change_row(row):
+        row['baz'] += ' changed'
+    o2o_form = make_form(TestOneToOneModel, ['bar'])
+    return Group({'group': 'fixture', 'rows': rows, 'fields': 1, 'choices': 0},
+            {'form_class': make_form(TestMainModel, ['foo']),
+                'formsets': {make_formset(TestMainModel, TestRelatedModel, ['baz']): 'main_model'},
+                'inline_1to1': {'o2o': o2o_form}},
+            obj, change_row, {'inline_1to1': {'o2o': o2o_form()}})
+
+_wide_models = {}
+
+def wide_models(fields):
+    """ Synthetic main and row models, created once per field count """
+    if fields in _wide_models:
+        return _wide_models[fields]
+    module = __name__
+    meta = lambda: type('Meta', (), {'app_label': 'djanx'})
+    choice = type('BenchChoice%d' % fields, (models.Model,), {'__module__': module,
+        'Meta': meta(), 'name': models.CharField(max_length=50),
+        '__str__': lambda self: self.name})
+    main = type('BenchMain%d' % fields, (models.Model,), {'__module__': module,
+        'Meta': meta(), 'name': models.CharField(max_length=50)})
+    attrs = {'__module__': module, 'Meta': meta(),
+            'main': models.ForeignKey(main, on_delete=models.CASCADE),
+            'choice': models.ForeignKey(choice, on_delete=models.CASCADE)}
+    kinds = [lambda: models.CharField(max_length=50), models.IntegerField,
+            lambda: models.DecimalField(max_digits=10, decimal_places=2), models.DateField,
+            models.BooleanField]
+    for i in range(fields):
+        attrs['f%d' % i] = kinds[i % len(kinds)]()
+    row = type('BenchRow%d' % fields, (models.Model,), attrs)
+    create_tables(choice, main, row)
+    _wide_models[fields] = (choice, main, row)
+    return _wide_models[fields]
+
+def wide_group(rows, fields, choices):
+    choice_model, main_model, row_model = wide_models(fields)
+    choice_model.objects.all().delete()
+    choice_model.objects.bulk_create(
+            [choice_model(name='Choice %d' % i) for i in range(max(choices, 1))])
+    choice_pks = list(choice_model.objects.values_list('pk', flat=True))
+    obj = main_model.objects.create(name='MAIN')
+    values = ['text', 7, decimal.Decimal('12.50'), datetime.date(2017, 6, 1), True]
+    row_model.objects.bulk_create([row_model(main=obj, choice_id=choice_pks[i % len(choice_pks)],
+        **{'f%d' % f: values[f % len(values)] for f in range(fields)}) for i in range(rows)])
+
+    row_fields = ['choice'] + ['f%d' % f for f in range(fields)]
+    def change_row(row):
+        if fields:
+            row['f0'] += ' changed'
+    return Group({'group': 'wide', 'rows': rows, 'fields': fields, 'choices': choices},
+            {'form_class': make_form(main_model, ['name']),
+                'formsets': {make_formset(main_model, row_model, row_fields): 'main'}},
+            obj, change_row)
+
+def in_data(group, content):
+    """ What the frontend sends back after changing every formset row """
+    data = dict((k, v) for (k, v) in list(content.items()) if k != 'formsets')
+    data['formsets'] = {}
+    for (reverse_lookup, rows) in list(content['formsets'].items()):
+        rows = [dict(row) for row in rows]
+        for row in rows:
+            group.change_row(row)
+        data['formsets'][reverse_lookup] = rows
+    # Through the codec, as a request body would be
+    return codec.loads(codec.dumps(data))
+
+def stage_runs(group):
+    """
+    Yields (stage, setup, run): setup() prepares what run(prepared) needs,
+    so only run is measured.
+    """
+    pk = group.obj.pk
+    yield 'get_object', lambda: group.form_group(True), lambda fg: fg.get_object(pk)
+
+    def serialized():
+        fg = group.form_group(True)
+        return fg, fg.get_object(pk)
+    yield 'serialize', serialized, lambda args: args[0].serialize(args[1])
+
+    def encoded():
+        fg, obj = serialized()
+        content, schema, order = fg.serialize(obj)
+        return {'contents': content, 'schema': schema, 'order': order}
+    yield 'encode', encoded, codec.dumps
+
+    content = encoded()['contents']
+    data = in_data(group, content)
+    yield 'deserialize', lambda: group.form_group(), lambda fg: fg.deserialize(data)
+
+    def deserialized(**kwargs):
+        fg = group.form_group(**kwargs)
+        fg.deserialize(data)
+        return fg
+    def is_valid(fg):
+        assert fg.is_valid(), fg.errors
+    yield 'is_valid', deserialized, is_valid
+
+    def validated(**kwargs):
+        fg = deserialized(**kwargs)
+        is_valid(fg)
+        return fg
+    yield 'save', validated, lambda fg: fg.save(commit=True)
+    yield 'save_bulk', lambda: validated(bulk_save=True), lambda fg: fg.save(commit=True)
+
+def measure(setup, run, repeat):
+    """
+    Returns (best seconds, queries, peak bytes) of run(setup()).  Every run
+    is rolled back, so each sees the same data.
+    """
+    best = None
+    queries = None
+    for i in range(repeat):
+        with transaction.atomic():
+            prepared = setup()
+            instrument = Instrument()
+            gc.collect()
+            reset_queries()
+            with instrument.stage('run'):
+                run(prepared)
+            stage = instrument.stages[-1]
+            check_queries(stage.queries)
+            best = stage.duration if best is None else min(best, stage.duration)
+            queries = stage.queries
+            transaction.set_rollback(True)
+
+    with transaction.atomic():
+        prepared = setup()
+        gc.collect()
+        tracemalloc.start()
+        try:
+            run(prepared)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        transaction.set_rollback(True)
+    return best, queries, peak
+
+def check_queries(queries):
+    """
+    Fails if the query count disagrees with the connection's query log.  On
+    Django before 2.0 both come from the debug cursor; the log only holds
+    the last queries_log.maxlen, so it is compared while it is not full.
+    """
+    if hasattr(connection, 'execute_wrapper'):
+        return
+    logged = len(connection.queries_log)
+    if logged < connection.queries_log.maxlen and logged != queries:
+        raise RuntimeError('Counted %d queries but %d were logged' % (queries, logged))
+
+def run_grid(rows_list, fields_list, choices_list, repeat, stages):
+    environment = {'python': platform.python_version(), 'django': django.get_version(),
+            'codec': codec.get_codec().name}
+    # Outside the transactions below, which are rolled back
+    create_tables(TestOneToOneModel, TestMainModel, TestRelatedModel)
+    for fields in fields_list:
+        wide_models(fields)
+
+    groups = [fixture_group]
+    groups.extend(lambda rows, fields=fields, choices=choices: wide_group(rows, fields, choices)
+            for fields in fields_list for choices in choices_list)
+    for make_group in groups:
+        for rows in rows_list:
+            with transaction.atomic():
+                group = make_group(rows)
+                for (stage, setup, run) in stage_runs(group):
+                    if stage not in stages:
+                        continue
+                    seconds, queries, peak = measure(setup, run, repeat)
+                    result = dict(group.params, stage=stage, seconds=seconds,
+                            queries=queries, peak_bytes=peak, repeat=repeat)
+                    result.update(environment)
+                    yield result
+                transaction.set_rollback(True)
+
+def result_key(result):
+    return (result['group'], result['rows'], result['fields'], result['choices'], result['stage'])
+
+def compare(baseline_file, results):
+    baseline = {}
+    with open(baseline_file) as f:
+        for line in f:
+            if line.strip():
+                result = json.loads(line)
+                baseline[result_key(result)] = result
+    print('%-8s %6s %6s %7s %-12s %10s %10s %7s %9s' % ('group', 'rows', 'fields', 'choices',
+        'stage', 'base ms', 'new ms', 'ratio', 'queries'), file=sys.stderr)
+    for result in results:
+        old = baseline.get(result_key(result), None)
+        if old is None:
+            continue
+        print('%-8s %6d %6d %7d %-12s %10.2f %10.2f %7.2f %4d->%-4d' % (result_key(result)
+            + (old['seconds'] * 1000, result['seconds'] * 1000,
+                result['seconds'] / old['seconds'] if old['seconds'] else float('inf'),
+                old['queries'], result['queries'])), file=sys.stderr)
+
+def int_list(value):
+    return [int(v) for v in value.split(',') if v]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--rows', type=int_list, default=[10, 100, 1000, 10000],
+            help='formset row counts (comma separated)')
+    parser.add_argument('--fields', type=int_list, default=[5, 20],
+            help='field counts of the wide rows')
+    parser.add_argument('--choices', type=int_list, default=[10, 1000],
+            help='number of choices of the wide rows\' choice field')
+    parser.add_argument('--stages', type=lambda v: v.split(','), default=STAGES,
+            help='stages to measure, of %s' % ', '.join(STAGES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--codec', choices=sorted(codec.codecs.keys()), default=None)
+    parser.add_argument('--output', default=None, help='file for the results (JSON lines)')
+    parser.add_argument('--compare', default=None, help='earlier results to compare with')
+    args = parser.parse_args(argv)
+
+    if args.codec:
+        codec.set_codec(args.codec)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    results = []
+    try:
+        for result in run_grid(args.rows, args.fields, args.choices, args.repeat, args.stages):
+            out.write(json.dumps(result, sort_keys=True) + '\n')
+            out.flush()
+            results.append(result)
+    finally:
+        if args.output:
+            out.close()
+    if args.compare:
+        compare(args.compare, results)
+
+if __name__ == '__main__':
+    main()
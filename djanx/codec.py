@@ -0,0 +1,98 @@
+import json
+from django import http
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import six
+
+class JSONCodec(object):
+    """
+    Encodes and decodes the JSON exchanged with the frontend, using the
+    standard library and DjangoJSONEncoder.
+    """
+
+    name = 'json'
+
+    def dumps(self, obj):
+        return json.dumps(obj, cls=DjangoJSONEncoder)
+
+    def loads(self, data):
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        return json.loads(data)
+
+class OrjsonCodec(JSONCodec):
+    """
+    JSONCodec using orjson.  Dates, times, decimals, UUIDs and lazy strings
+    come out exactly as DjangoJSONEncoder writes them; only the whitespace
+    between items differs.  Anything orjson cannot encode (such as integers
+    over 64 bits) is encoded by JSONCodec instead.
+    """
+
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+        # orjson writes datetimes differently from DjangoJSONEncoder (full
+        # microseconds, +00:00), so pass them to DjangoJSONEncoder.default too.
+        self._options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        self._default = DjangoJSONEncoder().default
+
+    def dumps(self, obj):
+        try:
+            return self._orjson.dumps(obj, default=self._default,
+                    option=self._options).decode('utf-8')
+        except TypeError:
+            return super(OrjsonCodec, self).dumps(obj)
+
+    def loads(self, data):
+        return self._orjson.loads(data)
+
+codecs = {'json': JSONCodec, 'orjson': OrjsonCodec}
+
+_codec = None
+
+def get_codec():
+    """
+    Returns the codec in use: the one given to set_codec, otherwise the
+    fastest one installed.
+    """
+    global _codec
+    if _codec is None:
+        try:
+            _codec = OrjsonCodec()
+        except ImportError:
+            _codec = JSONCodec()
+    return _codec
+
+def set_codec(codec):
+    """
+    Selects the codec used by djanx.  codec is a name from codecs, a codec
+    instance, or None to go back to the fastest one installed.
+    """
+    global _codec
+    _codec = codecs[codec]() if isinstance(codec, six.string_types) else codec
+
+def dumps(obj):
+    return get_codec().dumps(obj)
+
+def loads(data):
+    return get_codec().loads(data)
+
+class JsonResponse(http.JsonResponse):
+    """
+    django.http.JsonResponse encoding data with get_codec() unless an encoder
+    class is given.
+    """
+
+    def __init__(self, data, encoder=None, safe=True, json_dumps_params=None, **kwargs):
+        if encoder is not None or json_dumps_params is not None:
+            super(JsonResponse, self).__init__(data, encoder or DjangoJSONEncoder,
+                    safe, json_dumps_params, **kwargs)
+            return
+        if safe and not isinstance(data, dict):
+            raise TypeError(
+                'In order to allow non-dict objects to be serialized set the '
+                'safe parameter to False.'
+            )
+        kwargs.setdefault('content_type', 'application/json')
+        http.HttpResponse.__init__(self, content=dumps(data), **kwargs)
@@ -0,0 +1,232 @@
+import collections, hashlib, threading, time, uuid
+from django.core.cache import caches
+from django.core.exceptions import FieldDoesNotExist
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+
+class ContentCache(object):
+    """
+    Caches the content FormGroup.serialize builds for an object, in one of
+    Django's caches, keyed by the form group's structure and the object's pk.
+
+    Entries are invalidated by post_save / post_delete on the main model, the
+    formset models and the one-to-one models of every group that uses the
+    cache, both straight away and when the transaction commits.  Writes that
+    send no signals (QuerySet.update, bulk_create, raw SQL) are not seen;
+    call invalidate for those.  FormGroup.save invalidates its object itself.
+
+    Choices and other data from models outside the group are not tracked,
+    so pick a timeout that is acceptable for them.
+
+    Concurrent misses for the same object compute the content once: the
+    first takes a lock (cache.add) and the others wait up to lock_timeout
+    for its result.
+
+    The signal receivers stay connected for as long as the cache exists;
+    call disconnect when discarding a ContentCache before the end of the
+    process.
+    """
+
+    def __init__(self, alias='default', timeout=300, lock_timeout=10, key_prefix='djanx.content',
+            poll_interval=0.05):
+        self.alias = alias
+        self.timeout = timeout
+        self.lock_timeout = lock_timeout
+        self.key_prefix = key_prefix
+        self.poll_interval = poll_interval
+        self._registered = set()
+        self._receivers = [] # (model, dispatch_uid)
+        self._local_locks = [threading.Lock() for i in range(64)]
+        self._lock = threading.Lock()
+        self._stats = collections.Counter()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get_or_compute(self, group, pk, compute):
+        """
+        Returns the cached content for group's object pk, or compute()'s
+        result, which is then cached.
+        """
+        cache = self.cache
+        group_key = self.register(group)
+        version_key = self._version_key(group_key, pk)
+        version = cache.get(version_key)
+        if version is None:
+            # New or evicted.  Versions are never reused, so entries cached
+            # under an evicted version stay orphaned.
+            cache.add(version_key, uuid.uuid4().hex, None)
+            version = cache.get(version_key) or uuid.uuid4().hex
+        key = self._key(group_key, pk, version, group.columnar)
+
+        value = cache.get(key)
+        if value is not None:
+            self._count('hits')
+            return value
+        self._count('misses')
+
+        # Threads of this process queue here; other processes on the lock below
+        with self._local_lock(key):
+            value = cache.get(key)
+            if value is not None:
+                self._count('hits')
+                return value
+
+            lock_key = key + ':lock'
+            token = uuid.uuid4().hex
+            if not cache.add(lock_key, token, self.lock_timeout):
+                value = self._wait(cache, key, lock_key)
+                if value is not None:
+                    self._count('waits')
+                    return value
+                # The other computation failed or is too slow; do it here
+                cache.add(lock_key, token, self.lock_timeout)
+            try:
+                value = compute()
+                self._count('computes')
+                # Written under the version read before computing, so content
+                # computed during a write is never read after it.
+                cache.set(key, value, self.timeout)
+            finally:
+                if cache.get(lock_key) == token:
+                    cache.delete(lock_key)
+            return value
+
+    def invalidate(self, group, pk):
+        """
+        Invalidates the cached content of group's object pk.
+        """
+        self._invalidate(self.register(group), [pk])
+
+    def stats(self):
+        """
+        Returns this process's counters: hits, misses, waits (misses answered
+        by another computation), computes and invalidations.
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def disconnect(self):
+        """
+        Disconnects the invalidation signals of every registered group.
+        """
+        with self._lock:
+            for (model, uid) in self._receivers:
+                post_save.disconnect(sender=model, dispatch_uid=uid)
+                post_delete.disconnect(sender=model, dispatch_uid=uid)
+            self._receivers = []
+            self._registered.clear()
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+
+    def register(self, group):
+        """
+        Connects the invalidation signals for group's models, once per group
+        structure.  Returns the group's key.
+        """
+        plan = group.plan
+        group_key = plan.content_cache_key
+        if group_key is None:
+            group_key = plan.content_cache_key = _group_key(plan)
+        if group_key in self._registered:
+            return group_key
+        with self._lock:
+            if group_key in self._registered:
+                return group_key
+            self._connect(group_key, plan.model, lambda instance: [instance.pk])
+            for (formset, other_model_field, _) in plan.formsets:
+                attname = formset.model._meta.get_field(other_model_field).attname
+                self._connect(group_key, formset.model,
+                        lambda instance, attname=attname: [getattr(instance, attname)])
+            for (o2o_field, _, other_model, attname) in plan.inline_1to1:
+                self._connect(group_key, other_model, _o2o_main_pks(plan.model, o2o_field))
+            self._registered.add(group_key)
+        return group_key
+
+    def _connect(self, group_key, model, main_pks):
+        def receiver(sender, instance, **kwargs):
+            pks = [pk for pk in main_pks(instance) if pk is not None]
+            if not pks:
+                return
+            self._invalidate(group_key, pks)
+            # Again once committed, in case the content was recomputed from
+            # the old rows in the meantime.
+            using = kwargs.get('using', None)
+            transaction.on_commit(lambda: self._invalidate(group_key, pks), using=using)
+
+        uid = 'djanx.content_cache.%s.%s.%s' % (id(self), group_key, model._meta.label)
+        post_save.connect(receiver, sender=model, weak=False, dispatch_uid=uid)
+        post_delete.connect(receiver, sender=model, weak=False, dispatch_uid=uid)
+        self._receivers.append((model, uid))
+
+    def _invalidate(self, group_key, pks):
+        cache = self.cache
+        for pk in pks:
+            # A new version orphans the cached entry and anything being
+            # computed from before the write.
+            cache.set(self._version_key(group_key, pk), uuid.uuid4().hex, None)
+            self._count('invalidations')
+
+    def _wait(self, cache, key, lock_key):
+        deadline = time.time() + self.lock_timeout
+        while time.time() < deadline:
+            time.sleep(self.poll_interval)
+            value = cache.get(key)
+            if value is not None:
+                return value
+            if cache.get(lock_key) is None:
+                return cache.get(key)
+        return None
+
+    def _local_lock(self, key):
+        # Striped, so that the number of locks stays fixed
+        return self._local_locks[hash(key) % len(self._local_locks)]
+
+    def _key(self, group_key, pk, version, columnar):
+        # Both encodings share the version key, so one write invalidates both
+        return '%s:%s:%s:%s:%s' % (self.key_prefix, group_key, pk, version,
+                'columnar' if columnar else 'rows')
+
+    def _version_key(self, group_key, pk):
+        return '%s:%s:%s:version' % (self.key_prefix, group_key, pk)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+def _o2o_main_pks(model, o2o_field):
+    """
+    For the one-to-one inline o2o_field of model, a function from an object
+    of the other model to the pks of the model objects it belongs to.
+    """
+    try:
+        field = model._meta.get_field(o2o_field)
+    except FieldDoesNotExist:
+        field = None
+    if field is not None and field.one_to_one and not field.concrete:
+        # Reverse: the other model points to model
+        remote = field.field
+        if remote.target_field.primary_key:
+            return lambda instance: [getattr(instance, remote.attname)]
+        return lambda instance: list(model._default_manager.filter(
+                **{remote.target_field.name: getattr(instance, remote.attname)})
+                    .values_list('pk', flat=True))
+    return lambda instance: list(model._default_manager.filter(**{o2o_field: instance.pk})
+            .values_list('pk', flat=True))
+
+def _group_key(plan):
+    """
+    A key for a group structure that is the same in every process.
+    """
+    def name(cls):
+        return '%s.%s' % (cls.__module__, cls.__name__)
+    parts = [name(plan.form_class)]
+    parts.extend('%s:%s:%s:%s' % (name(fs), field, name(fs.form),
+                getattr(fs, 'window_size', None))
+            for (fs, field, _) in plan.formsets)
+    parts.extend('%s:%s' % (field, name(form_class))
+            for (field, form_class, _, _) in plan.inline_1to1)
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()[:16]
@@ -1,16 +1,119 @@
-import itertools , collections
-from django.core.exceptions import ValidationError
+import itertools , collections, hashlib, functools, threading
+from concurrent.futures import ThreadPoolExecutor
+from django.core.exceptions import ValidationError, ObjectDoesNotExist, FieldDoesNotExist
+from django.core.cache import caches
+from django.db import models, router, connections
+from django.db.models import prefetch_related_objects, Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import six
+from django.utils.http import quote_etag
+from django.forms.models import model_to_dict as forms_model_to_dict
 
-from .utils import model_to_dict
+from .utils import model_to_dict, get_serializer, plan_related, bulk_update, iter_chunks
+from .forms import get_lazy_choices, get_annotated_static, annotate_static, expand_rows
+from .schema_cache import schema_cache, make_schema_key, schema_hash
+from .instrumentation import no_stage
 
-class FormGroup(object):
+# Validation states of a FormGroup
+UNBOUND = 'unbound' # No data yet; see FormGroup.deserialize
+BOUND = 'bound'     # Data bound but not validated
+VALID = 'valid'
+INVALID = 'invalid'
+
+# The cache that records recent saves for FormGroup's read_your_writes
+READ_YOUR_WRITES_CACHE = 'default'
+
+# Most group structures resolved are kept, least recently used first.  Groups
+# built from classes made per request (e.g. by inlineformset_factory) each
+# have a structure of their own, so the plans are bounded.
+MAX_PLANS = 256
+_plans = collections.OrderedDict()
+_plans_lock = threading.Lock()
+
+def get_group_plan(form_class, formsets, inline_1to1):
+    """
+    Returns the FormGroupPlan for a group structure, resolving it on first use.
+    """
+    key = (form_class, tuple(formsets.items()), 
+            tuple((field, _form_class(form)) for (field, form) in inline_1to1.items()))
+    with _plans_lock:
+        plan = _plans.pop(key, None)
+        if plan is not None:
+            _plans[key] = plan # Move to most recently used
+            return plan
+    plan = FormGroupPlan(form_class, formsets, inline_1to1)
+    with _plans_lock:
+        _plans[key] = plan
+        while len(_plans) > MAX_PLANS:
+            _plans.popitem(last=False)
+    return plan
+
+class FormGroupPlan(object):
+    """
+    The model metadata a FormGroup needs for loading and binding data,
+    resolved once per group structure instead of on every request.
+    """
+
+    # The group's key in content caches; see djanx.content_cache
+    content_cache_key = None
+
+    def __init__(self, form_class, formsets, inline_1to1):
+        self.form_class = form_class
+        self.model = form_class._meta.model
+
+        # (formset class, ForeignKey field name, reverse lookup name)
+        self.formsets = tuple((fs, other_model_field, _reverse_lookup(fs, other_model_field))
+                for (fs, other_model_field) in formsets.items())
+
+        # (field name, form class, model, attname).  attname is None unless the
+        # field is a OneToOneField on the main model, in which case the other
+        # object is loaded along with the main object.
+        self.inline_1to1 = []
+        for (o2o_field, form) in inline_1to1.items():
+            other_form_class = _form_class(form)
+            try:
+                field = self.model._meta.get_field(o2o_field)
+            except FieldDoesNotExist:
+                attname = None
+            else:
+                attname = field.attname if field.one_to_one and field.concrete else None
+            self.inline_1to1.append((o2o_field, other_form_class, 
+                other_form_class._meta.model, attname))
+        self.inline_1to1 = tuple(self.inline_1to1)
+
+class FormGroupMetaclass(type):
+    """
+    Resolves the plan of FormGroup subclasses that declare form_class (and
+    optionally formsets and inline_1to1) as class attributes.
+    """
+
+    def __init__(cls, name, bases, attrs):
+        super(FormGroupMetaclass, cls).__init__(name, bases, attrs)
+        if cls.form_class is not None:
+            cls.plan = get_group_plan(cls.form_class, cls.formsets, cls.inline_1to1)
+
+class FormGroup(six.with_metaclass(FormGroupMetaclass, object)):
     """
     Convenience class for serializing and deserializing a group of forms consisting of 
     a main ModelForm, zero or more related ModelFormSets, and zero or more
     ModelForms related through a OneToOneField on the main form.
+
+    The forms can be passed to the constructor or declared on a subclass:
+
+        class OrderGroup(FormGroup):
+            form_class = OrderForm
+            formsets = {OrderLineFormSet: 'order'}
+            inline_1to1 = {'address': AddressForm}
     """
 
-    def __init__(self, form_class, formsets={}, inline_1to1={}):
+    form_class = None
+    formsets = {}
+    inline_1to1 = {}
+    plan = None
+
+    def __init__(self, form_class=None, formsets=None, inline_1to1=None, cache_schema=False,
+            bulk_save=False, columnar=False, content_cache=None, instrument=None,
+            read_using=None, read_your_writes=0, concurrent_reads=0):
         """
         Args:
             form_class (subclass of DjanxForm): the form class
@@ -20,10 +123,78 @@ class FormGroup(object):
 
             inline_1to1 (dict): mapping from str to DjanxModelFormSet. key is the name 
             of the OneToOneField field in the model.
+
+            cache_schema (bool): if True, serialize reuses schemas from
+            djanx.schema_cache.schema_cache instead of rebuilding them.  Call
+            invalidate_schema_cache when choices for the forms change.  Only
+            cached schemas get a 'hash_', so clients can only skip downloading
+            schemas they already have if this is set.
+
+            bulk_save (bool): if True, save writes each formset's rows with
+            bulk_create / bulk update / a single delete.  See save.
+
+            columnar (bool): if True, serialize sends each formset's rows as
+            {'columns': [field names], 'rows': [[values], ...]} instead of a
+            list of dicts.  The form fields come first in columns, in the order
+            of the formset schema's 'fields'.  DjanxFormSetMixin.from_json and
+            the djanx angular service accept both forms.
+
+            content_cache (djanx.content_cache.ContentCache or None): if given,
+            serialize caches the content of objects in it; see ContentCache.
+
+            instrument (djanx.instrumentation.Instrument or None): if given,
+            records the time and queries of each stage of serialize,
+            get_object, deserialize, is_valid, errors and save.  The stages
+            are named after the method, with sub-stages such as
+            'serialize.schema', 'serialize.main', 'save.formset.<reverse
+            lookup>' and 'is_valid.o2o.<field>'.  Each name is recorded at
+            most once per call.
+
+            read_using (str or None): the database alias (e.g. a read replica)
+            that get_object, serialize, serialize_many, get_window and
+            get_validator read from: the main object, the formset rows, the
+            one-to-one objects, static values and choices.  Objects passed in
+            are used as they are, and their related objects are read from
+            where they were loaded; load them with get_object.  deserialize
+            and save always use the router's write database.
+
+            read_your_writes (int): with read_using, the number of seconds
+            after save(commit=True) during which reads of the saved object go
+            to the write database instead, so that a client sees its own
+            save.  Saves are recorded in the READ_YOUR_WRITES_CACHE cache.
+
+            concurrent_reads (int): if non-zero, serialize fetches the rows of
+            the formsets in up to this many threads, each with a database
+            connection of its own, while it reads the main object, its
+            one-to-ones and the schema.  A serialize then takes about as long
+            as its slowest query rather than the sum of them.  Not done for
+            formsets whose database connection is in a transaction, which
+            the other connections could not see into.  The instrument does
+            not count the queries of the threads.
+
+        form_class, formsets and inline_1to1 default to the class attributes.
         """
-        self.form_class = form_class
-        self.formsets = formsets
-        self.inline_1to1 = inline_1to1
+        if form_class is not None:
+            self.form_class = form_class
+        if formsets is not None:
+            self.formsets = formsets
+        if inline_1to1 is not None:
+            self.inline_1to1 = inline_1to1
+        if self.form_class is None:
+            raise TypeError("%s needs a form_class" % self.__class__.__name__)
+        if form_class is not None or formsets is not None or inline_1to1 is not None:
+            self.plan = get_group_plan(self.form_class, self.formsets, self.inline_1to1)
+        self.cache_schema = cache_schema
+        self.bulk_save = bulk_save
+        self.columnar = columnar
+        self.content_cache = content_cache
+        self.instrument = instrument
+        self.read_using = read_using
+        self.read_your_writes = read_your_writes
+        self.concurrent_reads = concurrent_reads
+        self.read_db = read_using # Where the current object is read from; see _route
+        self.validation_state = UNBOUND
+        self._errors = None
 
     def serialize(self, obj=None, fs_querysets={}, field_overrides={}):
         """
@@ -41,63 +212,550 @@ class FormGroup(object):
         Returns:
             tuple: content, schema, order.  
             content is a dict: field name -> value.  Empty if obj is not given.
-            schema is a dict: field name -> Djanx schema (used in frontend)
+            If obj was loaded with get_object (or from get_queryset) it also
+            has the values of the main form's Meta.static fields.
+            schema is a dict: field name -> Djanx schema (used in frontend).
+            If the group has cache_schema, schema['hash_'] is a hash of
+            everything in it except the formset total_forms / initial_forms.
             order is a list of field names in the order given by the field.
+
+        If the group has a content_cache and fs_querysets is not given, the
+        content and order come from the cache when possible.
+        """
+        self._route(obj)
+        with self._stage('serialize'):
+            if obj is not None and self.content_cache is not None and not fs_querysets:
+                return self._serialize_cached(obj, field_overrides)
+            return self._serialize(obj, fs_querysets, field_overrides)
+
+    def _stage(self, name):
+        return self.instrument.stage(name) if self.instrument is not None else no_stage
+
+    def _route(self, obj):
+        """
+        Sets read_db for reading obj (a model instance, a pk or None): the
+        write database if obj was saved within read_your_writes seconds,
+        otherwise read_using.
+        """
+        self.read_db = self.read_using
+        if self.read_using is None or not self.read_your_writes or obj is None:
+            return
+        if caches[READ_YOUR_WRITES_CACHE].get(self._written_key(getattr(obj, 'pk', obj))):
+            self.read_db = router.db_for_write(self.plan.model)
+
+    def _written_key(self, pk):
+        return 'djanx.written:%s:%s' % (self.plan.model._meta.label, pk)
+
+    def _reads(self, model):
+        """ model's default manager, reading from read_db """
+        return model._default_manager.db_manager(self.read_db)
+
+    def _writes(self, model):
+        """ model's default manager, on the router's write database """
+        return model._default_manager.db_manager(router.db_for_write(model))
+
+    def _serialize_cached(self, obj, field_overrides):
+        computed = []
+        def compute():
+            content, schema, order = self._serialize(obj, {}, field_overrides)
+            computed.append(schema)
+            return content, order
+        content, order = self.content_cache.get_or_compute(self, obj.pk, compute)
+        if computed:
+            return content, computed[0], order
+
+        fs_instances = {fs(instance=obj, queryset=self._plan_formset_queryset(fs)): fkey 
+                for (fs, fkey) in list(self.formsets.items())}
+        with self._stage('serialize.schema'):
+            schema = self._get_schema(obj, fs_instances, field_overrides)
+        for (fs_inst, other_model_field) in list(fs_instances.items()):
+            reverse_lookup = _reverse_lookup(fs_inst, other_model_field)
+            rows = content['formsets'][reverse_lookup]
+            if isinstance(rows, dict):
+                rows = rows['rows'] # Columnar
+            schema['formsets'][reverse_lookup].update(fs_inst.get_count_schema(len(rows)))
+        return content, schema, order
+
+    def serialize_stream(self, obj, fs_querysets={}, field_overrides={}, chunk_size=2000):
         """
+        Like serialize, but the formset rows are not fetched up front.  Each
+        entry of content['formsets'] is instead a generator of row dicts (or,
+        for a columnar group, the 'rows' entry is a generator of row lists)
+        that reads the rows chunk_size at a time with QuerySet.iterator(), and
+        the formset counts in the schema come from COUNT queries.
+
+        Used by BaseFormGroupView to stream large groups; see
+        djanx.streaming.iter_json.
+        """
+        self._route(obj)
+        with self._stage('serialize'):
+            return self._serialize(obj, fs_querysets, field_overrides, chunk_size)
+
+    def _serialize(self, obj, fs_querysets, field_overrides, chunk_size=None):
         form_class = self.form_class
         formsets = self.formsets
         inline_1to1 = self.inline_1to1
 
+        #if obj:
+        #    obj['extra_values'] = obj=obj).extra_values(content)
+        fs_instances = {fs(instance=obj, 
+                    queryset=self._plan_formset_queryset(fs, fs_querysets.get(fs, None))): fkey 
+                for (fs, fkey) in list(self.formsets.items())}
+        fetching = {}
+        if obj and chunk_size is None and self.concurrent_reads:
+            fetching = self._fetch_concurrently(fs_instances)
+
         model = form_class._meta.model
         if obj:
-            content = model_to_dict(obj)
+            with self._stage('serialize.main'):
+                # Cheap if obj came from get_queryset(); otherwise fetches the
+                # related objects with one query per lookup rather than per use.
+                prefetch_related_objects([obj], *itertools.chain(*self._plan_main()))
+                content = model_to_dict(obj)
+                content.update(get_annotated_static(form_class, obj) or {})
         else:
             content = {}
 
-        #if obj:
-        #    obj['extra_values'] = obj=obj).extra_values(content)
-        main_form = form_class(instance=obj)
-        for ((fname, attrname), val) in list(field_overrides.items()):
-            setattr(main_form.fields[fname], attrname, val)
-
-        fs_instances = {fs(instance=obj, queryset=fs_querysets.get(fs, None)): fkey 
-                for (fs, fkey) in list(self.formsets.items())}
-
-        schema = main_form.get_schema() 
-        #schema = form_class.get_base_schema()
+        with self._stage('serialize.schema'):
+            schema = self._get_schema(obj, fs_instances, field_overrides)
 
         field_order = list(form_class._meta.fields)
 
-        schema['formsets'] = collections.OrderedDict()
         content['formsets'] = collections.OrderedDict()
         for (fs_inst, other_model_field) in list(fs_instances.items()):
-            other_model = fs_inst.form._meta.model
-            reverse_lookup = other_model._meta.get_field(other_model_field).remote_field.name
-            schema['formsets'][reverse_lookup] = fs_inst.get_schema()
-            schema['formsets'][reverse_lookup]['_parent_key_field'] = other_model_field
+            reverse_lookup = _reverse_lookup(fs_inst, other_model_field)
             field_order.append(reverse_lookup)
-
-            if obj:
-                content['formsets'][reverse_lookup] = [model_to_dict(m) for m in fs_inst.queryset]
-            else:
-                content['formsets'][reverse_lookup] = []
+            with self._stage('serialize.formset.' + reverse_lookup):
+                rows = fetching[reverse_lookup].result() if reverse_lookup in fetching else None
+                content['formsets'][reverse_lookup] = self._serialize_formset(obj, fs_inst,
+                        reverse_lookup, schema, content, chunk_size, rows)
 
         for (o2o_field, otherform) in list(inline_1to1.items()):
-            schema[o2o_field] = otherform.get_schema()
-            schema[o2o_field]['type_'] = 'one2one'
             field_order.append(o2o_field)
 
-            if obj:
+        if obj:
+            for o2o_field in list(inline_1to1.keys()):
+                with self._stage('serialize.o2o.' + o2o_field):
+                    self._serialize_1to1(obj, content, [o2o_field])
+
+        return content, schema, field_order
+
+    def _fetch_concurrently(self, fs_instances):
+        """
+        Starts fetching the rows of the formsets in fs_instances in threads
+        of their own; see concurrent_reads.  The querysets are built here, so
+        the threads read from the same database as the rest of serialize.
+
+        Returns:
+            dict: reverse lookup -> Future of the evaluated queryset
+        """
+        jobs = {}
+        for (fs_inst, other_model_field) in list(fs_instances.items()):
+            queryset = _ordered(fs_inst.queryset, fs_inst.model)
+            if (getattr(fs_inst, 'window_size', None) 
+                    or connections[queryset.db].in_atomic_block):
+                continue
+            jobs[_reverse_lookup(fs_inst, other_model_field)] = queryset
+        if not jobs:
+            return {}
+        pool = ThreadPoolExecutor(max_workers=min(self.concurrent_reads, len(jobs)))
+        try:
+            return {reverse_lookup: pool.submit(_fetch_rows, queryset)
+                    for (reverse_lookup, queryset) in list(jobs.items())}
+        finally:
+            pool.shutdown(wait=False) # The threads end once the rows are fetched
+
+    def _serialize_formset(self, obj, fs_inst, reverse_lookup, schema, content, chunk_size,
+            rows=None):
+        """
+        Fills in the formset's counts in schema and returns its content.  rows
+        is the formset's queryset if it was already fetched.
+        """
+        window_size = getattr(fs_inst, 'window_size', None)
+        if obj and window_size:
+            qs = fs_inst.queryset
+            rows, window = self._window(qs, None, window_size)
+            window['total'] = qs.count()
+            window['window_size'] = window_size
+            schema['formsets'][reverse_lookup].update(fs_inst.get_count_schema(len(rows)))
+            content.setdefault('formset_windows', {})[reverse_lookup] = window
+            return self._formset_rows(fs_inst, rows)
+
+        if obj and chunk_size:
+            qs = fs_inst.queryset
+            if not qs.ordered:
+                qs = qs.order_by(fs_inst.model._meta.pk.name)
+            schema['formsets'][reverse_lookup].update(fs_inst.get_count_schema(qs.count()))
+            serializer = get_serializer(fs_inst.model)
+            if self.columnar:
+                columns = serializer.columns(fs_inst.form.base_fields)
+                return {'columns': columns, 'rows': _iter_rows(qs, 
+                    functools.partial(serializer.row, columns=columns), chunk_size)}
+            return _iter_rows(qs, serializer, chunk_size)
+
+        if obj and rows is not None:
+            fs_inst.set_queryset(rows)
+        schema['formsets'][reverse_lookup].update(fs_inst.get_count_schema())
+        if obj:
+            # get_queryset() is cached on the formset, so this reuses the
+            # rows already fetched for the counts above.
+            return self._formset_rows(fs_inst, fs_inst.get_queryset())
+        return self._formset_rows(fs_inst, [])
+
+    def serialize_many(self, queryset, fs_querysets={}, field_overrides={}, chunk_size=500):
+        """
+        Serializes every object in queryset, sharing one schema.
+
+        The objects are fetched chunk_size at a time.  For each chunk the
+        one-to-one inlines are joined in and each formset's rows are fetched
+        with a single IN query, so the number of queries depends on the number
+        of chunks rather than the number of objects.  Formsets whose class sets
+        window_size get only their first window per object, as from
+        serialize(), with one more query per chunk for the row totals.
+
+        Args:
+            queryset (QuerySet): the main model objects to serialize.
+
+            fs_querysets, field_overrides: as for serialize.
+
+            chunk_size (int): number of main objects to hold in memory at once.
+
+        Returns:
+            tuple: schema, order, contents.  schema and order are as for
+            serialize(), for an empty object (so the formset counts are those of
+            a new object).  contents is a generator yielding a content dict per
+            object, in queryset order.
+        """
+        _, schema, order = self.serialize(None, fs_querysets=fs_querysets, 
+                field_overrides=field_overrides)
+        if self.read_db is not None:
+            queryset = queryset.using(self.read_db)
+        return schema, order, self._iter_contents(queryset, fs_querysets, chunk_size)
+
+    def _iter_contents(self, queryset, fs_querysets, chunk_size):
+        select_related, prefetch_related = self._plan_main()
+        queryset = annotate_static(queryset.select_related(*select_related)
+                .prefetch_related(*prefetch_related), self.form_class)
+        serializer = get_serializer(self.form_class._meta.model)
+
+        for chunk in iter_chunks(queryset, chunk_size):
+            fs_rows = collections.OrderedDict()
+            for (fs, other_model_field) in list(self.formsets.items()):
+                fk = fs.model._meta.get_field(other_model_field)
+                parent_key = fk.target_field.attname
+                qs = self._plan_formset_queryset(fs, fs_querysets.get(fs, None)).filter(
+                        **{other_model_field+'__in': [getattr(obj, parent_key) for obj in chunk]})
+                window_size = getattr(fs, 'window_size', None)
+                totals = None
+                if window_size:
+                    qs, totals = self._window_many(qs, fk, window_size)
+                elif not qs.ordered:
+                    # Same order as the formset's own get_queryset()
+                    qs = qs.order_by(fs.model._meta.pk.name)
+                by_parent = collections.defaultdict(list)
+                for m in qs:
+                    by_parent[getattr(m, fk.attname)].append(m)
+                fs_rows[_reverse_lookup(fs, other_model_field)] = (parent_key, fs, by_parent,
+                        totals)
+
+            for obj in chunk:
+                content = serializer(obj)
+                content.update(get_annotated_static(self.form_class, obj) or {})
+                content['formsets'] = collections.OrderedDict()
+                for (reverse_lookup, (parent_key, fs, by_parent, totals)) in list(fs_rows.items()):
+                    rows = by_parent.get(getattr(obj, parent_key), [])
+                    if totals is not None:
+                        window_size = fs.window_size
+                        has_more = len(rows) > window_size
+                        rows = rows[:window_size]
+                        content.setdefault('formset_windows', {})[reverse_lookup] = {
+                                'has_more': has_more, 
+                                'next_after': rows[-1].pk if rows else None,
+                                'total': totals.get(getattr(obj, parent_key), 0),
+                                'window_size': window_size}
+                    content['formsets'][reverse_lookup] = self._formset_rows(fs, rows)
+                self._serialize_1to1(obj, content)
+                yield content
+
+    def get_window(self, obj, reverse_lookup, after=None, limit=None, fs_querysets={}):
+        """
+        Fetches a window of the existing rows of a formset whose class sets
+        window_size, with keyset pagination on the primary key.
+
+        Args:
+            obj (Model or pk): the main object.
+
+            reverse_lookup (str): the formset's name in content['formsets'].
+
+            after: the 'next_after' of the previous window, or None for the
+            first window.
+
+            limit (int): rows per window; defaults to the formset's window_size.
+
+        Returns:
+            dict: {'rows': the rows as in content['formsets'], 'has_more':...,
+            'next_after': pk of the last row, to pass as after}
+        """
+        for (fs, other_model_field, name) in self.plan.formsets:
+            if name == reverse_lookup and getattr(fs, 'window_size', None):
+                break
+        else:
+            raise ObjectDoesNotExist("No windowed formset %s" % reverse_lookup)
+
+        self._route(obj)
+        qs = self._plan_formset_queryset(fs, fs_querysets.get(fs, None)).filter(
+                **{other_model_field: obj})
+        rows, window = self._window(qs, after, limit or fs.window_size)
+        window['rows'] = self._formset_rows(fs, rows)
+        return window
+
+    def _window(self, queryset, after, limit):
+        """
+        Returns (rows, {'has_more':..., 'next_after':...}) for a window of
+        queryset in primary key order.  Windows are always in primary key
+        order, whatever the queryset's own ordering.
+        """
+        queryset = queryset.order_by('pk')
+        if after is not None:
+            queryset = queryset.filter(pk__gt=after)
+        rows = list(queryset[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return rows, {'has_more': has_more, 'next_after': rows[-1].pk if rows else after}
+
+    def _window_many(self, queryset, fk, limit):
+        """
+        The first windows of queryset's rows for all their parents (through
+        ForeignKey fk) at once.  Each row is ranked by the number of rows of
+        the same parent before it in primary key order, and those ranked
+        within limit fetched, with one more per parent to tell whether it has
+        more.
+
+        Returns:
+            tuple: the queryset of the windows' rows in primary key order, and
+            a dict: parent key -> number of rows in queryset
+        """
+        before = (queryset.filter(**{fk.attname: OuterRef(fk.attname), 'pk__lt': OuterRef('pk')})
+                .order_by().values(fk.attname).annotate(n=Count('pk')).values('n'))
+        rows = (queryset.annotate(_window_rank=Coalesce(
+                    Subquery(before, output_field=IntegerField()), 0))
+                .filter(_window_rank__lte=limit).order_by('pk'))
+        totals = dict(queryset.order_by().values_list(fk.attname).annotate(Count('pk')))
+        return rows, totals
+
+    def _formset_rows(self, formset, objs):
+        """
+        The content of a formset with the given rows: a list of dicts, or the
+        columnar form if the group is columnar.
+        """
+        serializer = get_serializer(formset.model)
+        if not self.columnar:
+            return serializer.many(objs)
+        columns = serializer.columns(formset.form.base_fields)
+        return {'columns': columns, 'rows': serializer.many_rows(objs, columns)}
+
+    def _serialize_1to1(self, obj, content, fields=None):
+        for o2o_field in (fields if fields is not None else list(self.inline_1to1.keys())):
+            try:
+                other_model = getattr(obj,o2o_field)
+            except AttributeError:
+                other_model = None
+            
+            if other_model:
+                content[o2o_field] = model_to_dict(other_model)
+
+    def get_validator(self, obj, version_field):
+        """
+        Computes a cheap validator for obj's group, for conditional GETs,
+        without serializing anything.
+
+        version_field is the name of a field present on the main model, the
+        formset models and the one-to-one models that changes whenever a row
+        does: either a timestamp (e.g. auto_now=True) or an integer version
+        counter.  The main object and its one-to-ones are read from obj (load
+        it with get_object to have them joined in); each formset costs one
+        query, for its row count and max timestamp, or for the pk and version
+        of each of its rows.
+
+        If the group has cache_schema the validator also covers the schema,
+        through its hash; otherwise schema changes (such as new choices) are
+        not reflected in it.
+
+        Returns:
+            tuple: (etag, last_modified), where etag is a quoted ETag string and
+            last_modified is a datetime if version_field is a DateTimeField,
+            otherwise None.  None if some model in the group lacks
+            version_field.
+        """
+        parts = []
+        stamps = []
+
+        def add(model, value):
+            if isinstance(model._meta.get_field(version_field), models.DateTimeField) and value is not None:
+                stamps.append(value)
+            parts.append(value)
+
+        try:
+            add(obj._meta.model, getattr(obj, version_field, None))
+            for o2o_field in list(self.inline_1to1.keys()):
                 try:
-                    other_model = getattr(obj,o2o_field)
+                    other = getattr(obj, o2o_field)
                 except AttributeError:
-                    other_model = None
-                
-                if other_model:
-                    content[o2o_field] = model_to_dict(other_model)
+                    other = None
+                if other is None:
+                    parts.append(None)
+                else:
+                    add(other._meta.model, getattr(other, version_field, None))
+
+            for (fs, other_model_field) in list(self.formsets.items()):
+                field = fs.model._meta.get_field(version_field)
+                rows = self._reads(fs.model).filter(**{other_model_field: obj})
+                if isinstance(field, models.DateField): # Includes DateTimeField
+                    result = rows.aggregate(rows=models.Count('pk'), 
+                            version=models.Max(version_field))
+                    parts.append(result['rows'])
+                    add(fs.model, result['version'])
+                else:
+                    # Counters of different rows can add up to the same sum,
+                    # so each row's version counts
+                    parts.append(list(rows.order_by('pk').values_list('pk', version_field)))
+        except FieldDoesNotExist:
+            return None
 
+        if self.cache_schema:
+            fs_instances = {fs(instance=obj, queryset=self._plan_formset_queryset(fs)): fkey
+                    for (fs, fkey) in list(self.formsets.items())}
+            parts.append(self._get_schema(obj, fs_instances, {})['hash_'])
 
-        return content, schema, field_order
+        digest = hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+        return quote_etag(digest), (max(stamps) if stamps else None)
+
+    def get_queryset(self):
+        """
+        Returns a queryset for the main model that loads the one-to-one inlines,
+        many-to-many values and Meta.static values along with the objects, so
+        that serialize does not need further queries for them.
+        """
+        select_related, prefetch_related = self._plan_main()
+        return annotate_static(self._reads(self.form_class._meta.model)
+                .select_related(*select_related).prefetch_related(*prefetch_related),
+                self.form_class)
+
+    def get_object(self, pk):
+        self._route(pk)
+        with self._stage('get_object'):
+            return self.get_queryset().get(pk=pk)
+
+    def _plan_main(self):
+        model = self.form_class._meta.model
+        select_related, prefetch_related = plan_related(model)
+        for o2o_field in list(self.inline_1to1.keys()):
+            other_model = model._meta.get_field(o2o_field).related_model
+            sub_select, sub_prefetch = plan_related(other_model, prefix=o2o_field+'__')
+            select_related += [o2o_field] + sub_select
+            prefetch_related += sub_prefetch
+        return select_related, prefetch_related
+
+    def _plan_formset_queryset(self, formset, queryset=None):
+        """
+        Adds the lookups model_to_dict needs to a formset queryset.
+        """
+        if queryset is None:
+            queryset = self._reads(formset.model).get_queryset()
+        elif self.read_db is not None:
+            queryset = queryset.using(self.read_db)
+        select_related, prefetch_related = plan_related(formset.model)
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
+
+    def _get_schema(self, obj, fs_instances, field_overrides):
+        """
+        The schema without the formset counts, from the schema cache if the
+        group uses it.
+        """
+        if self.cache_schema:
+            schema_key = make_schema_key(self.form_class, self.formsets, self.inline_1to1, 
+                    field_overrides, self.read_db)
+            schema = schema_cache.get(schema_key)
+        else:
+            schema = None
+
+        if schema is None:
+            schema = self._build_schema(obj, fs_instances, field_overrides)
+            if self.cache_schema:
+                # Hashed once per cache fill; uncached schemas are not worth it
+                schema['hash_'] = schema_hash(schema)
+                schema_cache.set(schema_key, schema)
+        return schema
+
+    def _build_schema(self, obj, fs_instances, field_overrides):
+        """
+        Builds the request-independent part of the schema: everything except
+        the formset total_forms / initial_forms counts.
+        """
+        main_form = self.form_class(instance=obj)
+        for ((fname, attrname), val) in list(field_overrides.items()):
+            setattr(main_form.fields[fname], attrname, val)
+
+        schema = main_form.get_schema(self.read_db)
+        #schema = form_class.get_base_schema()
+
+        schema['formsets'] = collections.OrderedDict()
+        for (fs_inst, other_model_field) in list(fs_instances.items()):
+            reverse_lookup = _reverse_lookup(fs_inst, other_model_field)
+            schema['formsets'][reverse_lookup] = fs_inst.get_static_schema(self.read_db)
+            schema['formsets'][reverse_lookup]['_parent_key_field'] = other_model_field
+            _set_choices_form(schema['formsets'][reverse_lookup]['form'], reverse_lookup)
+
+        for (o2o_field, otherform) in list(self.inline_1to1.items()):
+            schema[o2o_field] = otherform.get_schema(self.read_db)
+            schema[o2o_field]['type_'] = 'one2one'
+            _set_choices_form(schema[o2o_field], o2o_field)
+        return schema
+
+    def get_lazy_choices_field(self, field, form=None, field_overrides={}):
+        """
+        Finds a field configured in Meta.lazy_choices.
+
+        Args:
+            field (str): the field name.
+
+            form (str or None): None for the main form, otherwise the formset
+            reverse lookup name or the one-to-one field name, as given in the
+            'form' entry of the field's choices_lazy descriptor.
+
+            field_overrides (dict): as for serialize; applies to the main form.
+
+        Returns:
+            tuple: (formfield, lazy choices options).  formfield is the field
+            of a form instance, as the schema's is, so any narrowing of its
+            queryset done in the form's __init__ applies.
+
+        Raises:
+            ObjectDoesNotExist if there is no such lazily loaded field.
+        """
+        form_inst = None
+        if form is None:
+            form_inst = self.form_class()
+            for ((fname, attrname), val) in list(field_overrides.items()):
+                setattr(form_inst.fields[fname], attrname, val)
+        elif form in self.inline_1to1:
+            form_inst = self.inline_1to1[form]
+            if isinstance(form_inst, type):
+                form_inst = form_inst()
+        else:
+            for (fs, other_model_field) in list(self.formsets.items()):
+                if _reverse_lookup(fs, other_model_field) == form:
+                    form_inst = fs().get_schema_form()
+
+        lazy_choices = get_lazy_choices(form_inst) if form_inst is not None else {}
+        if field not in lazy_choices:
+            raise ObjectDoesNotExist("No lazily loaded choices for %s" % 
+                    (field if form is None else "%s.%s" % (form, field)))
+        return form_inst.fields[field], lazy_choices[field]
 
     def deserialize(self, in_data):
         """
@@ -109,70 +767,305 @@ class FormGroup(object):
             and value is a list of dicts for setting up the model with the ForeignKey.  
             For OneToOneFields, the key is the field name and value is a dict of values for
             the other model.
+
+        Existing objects are loaded with one query per model: the main object
+        together with its one-to-one objects, then the rows of each formset,
+        which also give the formset's initial_forms.
+
+        For formsets whose class sets window_size only the rows that are sent
+        are bound and saved; the rest are left alone, not deleted.
         """
-        form_class = self.form_class
-        formsets = self.formsets
-        inline_1to1 = self.inline_1to1
+        self._unbound()
+        with self._stage('deserialize'):
+            with self._stage('deserialize.load'):
+                instance = self._load_main(in_data)
 
-        if 'id' in in_data:
-            instance = form_class.Meta.model.objects.get(pk=in_data['id'])
-        else:
-            instance = None
-
-        # After excluding the formset and o2o data, whatever remains should be the 
-        # main form fields.
-        main_form_fields = in_data.copy()
-
-        self.bound_formsets = {} # Indexed by (reverse_lookup, other_model_field)
-        for (formset, other_model_field) in list(formsets.items()):
-            other_model = formset.form._meta.model
-            reverse_lookup = other_model._meta.get_field(other_model_field).remote_field.name
-            #import ipdb; ipdb.set_trace()
-            if instance:
-                initial_forms = formset.form._meta.model.objects.filter(**{other_model_field: instance.pk}).count()
-            else:
-                initial_forms = 0
-            bfs = formset.from_json(in_data['formsets'][reverse_lookup], initial_forms=initial_forms, instance=instance)
-
-            self.bound_formsets[reverse_lookup,other_model_field] = bfs
-
-        self.o2o_forms = {}
-        for (o2o_field, otherform_class) in list(inline_1to1.items()):
-            other_model_class = otherform_class.Meta.model
-            if o2o_field in in_data and in_data[o2o_field]:
-                # It's a model specification; deserialize it.
-                if 'id' in in_data[o2o_field]:
-                    o2o_obj = other_model_class.objects.get(id=in_data[o2o_field]['id'])
-                else:
-                    o2o_obj = None
-                o2o_form = otherform_class(in_data[o2o_field], initial=in_data[o2o_field], 
-                        instance=o2o_obj)
-                self.o2o_forms[o2o_field] = o2o_form
-                del main_form_fields[o2o_field]
+            # After excluding the formset and o2o data, whatever remains should be the 
+            # main form fields.
+            main_form_fields = in_data.copy()
+
+            self.bound_formsets = {} # Indexed by (reverse_lookup, other_model_field)
+            for (formset, other_model_field, reverse_lookup) in self.plan.formsets:
+                with self._stage('deserialize.formset.' + reverse_lookup):
+                    if instance and getattr(formset, 'window_size', None):
+                        bfs = self._bind_formset_window(formset, other_model_field, instance,
+                                in_data['formsets'][reverse_lookup])
+                        self.bound_formsets[reverse_lookup,other_model_field] = bfs
+                        continue
+                    if instance:
+                        queryset = _ordered(self._writes(formset.model).filter(
+                            **{other_model_field: instance.pk}), formset.model)
+                        initial_forms = len(queryset) # Fetches the rows
+                    else:
+                        queryset = None
+                        initial_forms = 0
+                    bfs = formset.from_json(in_data['formsets'][reverse_lookup], 
+                            initial_forms=initial_forms, instance=instance)
+                    if queryset is not None:
+                        bfs.set_queryset(queryset)
+
+                    self.bound_formsets[reverse_lookup,other_model_field] = bfs
+
+            self.o2o_forms = {}
+            for (o2o_field, otherform_class, other_model_class, attname) in self.plan.inline_1to1:
+                if o2o_field in in_data and in_data[o2o_field]:
+                    # It's a model specification; deserialize it.
+                    with self._stage('deserialize.o2o.' + o2o_field):
+                        o2o_obj = self._load_1to1(instance, in_data[o2o_field], 
+                                o2o_field, other_model_class, attname)
+                        o2o_form = otherform_class(in_data[o2o_field], initial=in_data[o2o_field], 
+                                instance=o2o_obj)
+                    self.o2o_forms[o2o_field] = o2o_form
+                    del main_form_fields[o2o_field]
                 
-        self.main_form = form_class(main_form_fields, initial=main_form_fields, 
-                instance=instance)
+            self.main_form = self.form_class(main_form_fields, initial=main_form_fields, 
+                    instance=instance)
+            self._bound()
 
+    def _load_main(self, in_data):
+        """
+        The main object in_data refers to, or None.  The one-to-one objects
+        in_data refers to are fetched in the same query.
+        """
+        if 'id' not in in_data:
+            return None
+        related = [o2o_field for (o2o_field, _, _, attname) in self.plan.inline_1to1
+                if attname and isinstance(in_data.get(o2o_field), dict) 
+                    and 'id' in in_data[o2o_field]]
+        queryset = self._writes(self.plan.model).all()
+        if related:
+            queryset = queryset.select_related(*related)
+        return queryset.get(pk=in_data['id'])
+
+    def _load_1to1(self, instance, o2o_data, o2o_field, model, attname):
+        """
+        The one-to-one object o2o_data refers to, or None.  It only needs a
+        query if it is not the one the main object already points to.
+        """
+        if 'id' not in o2o_data:
+            return None
+        if (instance is not None and attname and getattr(instance, attname) is not None
+                and six.text_type(getattr(instance, attname)) == six.text_type(o2o_data['id'])):
+            return getattr(instance, o2o_field)
+        return self._writes(model).get(pk=o2o_data['id'])
+
+    def deserialize_delta(self, in_data):
+        """
+        Like deserialize, but in_data only describes what changed in an existing
+        group, and only the touched formset rows are bound, validated and saved.
+
+        Args:
+            in_data (dict): must contain the main object's 'id'.  Other entries
+            are the changed main form fields, and for one-to-one fields a dict
+            of the changed fields (plus 'id' if the other object exists).
+            'formsets' maps reverse lookup names to dicts with any of:
+
+                added: list of dicts, one per new row.
+                changed: list of dicts of the changed fields of existing rows,
+                each with the row's 'id'.
+                deleted: list of ids of rows to delete.
+
+        Values missing from in_data are taken from the database, so the forms
+        are validated as a whole.  A missing main or changed row 'id', and
+        changed or deleted rows that do not belong to the object, raise
+        ObjectDoesNotExist.  Formsets whose class sets
+        delta_requires_full = True (e.g. because their clean() checks all
+        rows together) are bound with every row, with the delta applied on top.
+        """
+        self._unbound()
+        with self._stage('deserialize'):
+            form_class = self.form_class
+            if in_data.get('id') in (None, ''):
+                raise ObjectDoesNotExist("No %s id given" % self.plan.model._meta.verbose_name)
+            with self._stage('deserialize.load'):
+                instance = self._load_main(in_data)
+            fs_data = in_data.get('formsets', {})
+
+            self.bound_formsets = {} # Indexed by (reverse_lookup, other_model_field)
+            for (formset, other_model_field, reverse_lookup) in self.plan.formsets:
+                if reverse_lookup not in fs_data:
+                    continue
+                with self._stage('deserialize.formset.' + reverse_lookup):
+                    delta = fs_data[reverse_lookup]
+                    bfs = self._bind_formset_delta(formset, other_model_field, instance, delta)
+                    self.bound_formsets[reverse_lookup,other_model_field] = bfs
+
+            self.o2o_forms = {}
+            for (o2o_field, otherform_class, other_model_class, attname) in self.plan.inline_1to1:
+                if not in_data.get(o2o_field):
+                    continue
+                with self._stage('deserialize.o2o.' + o2o_field):
+                    o2o_obj = self._load_1to1(instance, in_data[o2o_field], 
+                            o2o_field, other_model_class, attname)
+                    if o2o_obj is not None:
+                        o2o_data = _form_initial(otherform_class, o2o_obj)
+                    else:
+                        o2o_data = {}
+                    o2o_data.update(in_data[o2o_field])
+                    self.o2o_forms[o2o_field] = otherform_class(o2o_data, initial=o2o_data, 
+                            instance=o2o_obj)
+
+            main_form_fields = _form_initial(form_class, instance)
+            main_form_fields.update((k, v) for (k, v) in list(in_data.items())
+                    if k != 'formsets' and k not in self.o2o_forms)
+            self.main_form = form_class(main_form_fields, initial=main_form_fields, 
+                    instance=instance)
+            self._bound()
+
+    def _bind_formset_delta(self, formset, other_model_field, instance, delta):
+        pk_name = formset.model._meta.pk.name
+        reverse_lookup = _reverse_lookup(formset, other_model_field)
+        # Ids are compared as text, since clients may send them as strings
+        changed = collections.OrderedDict()
+        for row in delta.get('changed', []):
+            if row.get(pk_name) in (None, ''):
+                raise ObjectDoesNotExist("%s changed row has no %s" % (reverse_lookup, pk_name))
+            changed[six.text_type(row[pk_name])] = row
+        deleted = dict((six.text_type(pk), pk) for pk in delta.get('deleted', []))
+
+        queryset = self._writes(formset.model).filter(**{other_model_field: instance})
+        if not getattr(formset, 'delta_requires_full', False):
+            queryset = queryset.filter(pk__in=[row[pk_name] for row in list(changed.values())]
+                    + list(deleted.values()))
+        queryset = queryset.order_by(pk_name)
+
+        # Existing rows first, as from_json expects; untouched fields keep
+        # their current values.
+        rows = []
+        found = set()
+        for obj in queryset:
+            key = six.text_type(obj.pk)
+            found.add(key)
+            row = _form_initial(formset.form, obj)
+            row[pk_name] = obj.pk
+            row.update(changed.pop(key, {}))
+            if key in deleted:
+                row['DELETE'] = True
+            rows.append(row)
+        missing = set(changed.keys()) | (set(deleted.keys()) - found)
+        if missing:
+            # Otherwise the formset would quietly treat them as new rows
+            raise ObjectDoesNotExist("%s rows %s do not exist" % (
+                reverse_lookup, ', '.join(sorted(missing))))
+        initial_forms = len(rows)
+        rows.extend(delta.get('added', []))
+
+        bfs = formset.from_json(rows, initial_forms=initial_forms, instance=instance)
+        bfs.set_queryset(queryset)
+        return bfs
+
+    def _unbound(self):
+        """
+        Called before new data is bound, so that a bind that fails does not
+        leave the previous validation standing.
+        """
+        self.validation_state = UNBOUND
+        self._errors = None
+
+    def _bound(self):
+        """
+        Called whenever new data is bound; forgets the previous validation.
+        """
+        self.validation_state = BOUND
+        self._errors = None
+
+    def _components(self):
+        """
+        Yields (stage name, errors key, form or formset) for everything in the
+        group, main form first.  The main form's key is None since its errors
+        are merged into the top level.
+        """
+        yield ('main', None, self.main_form)
+        for (o2o_field, form) in list(self.o2o_forms.items()):
+            yield ('o2o.' + o2o_field, o2o_field, form)
+        for ((reverse_lookup, _), fs) in list(self.bound_formsets.items()):
+            yield ('formset.' + reverse_lookup, reverse_lookup, fs)
+
+    def _bind_formset_window(self, formset, other_model_field, instance, data):
+        """
+        Binds only the rows in data: existing rows (those with a pk) first,
+        as from_json expects, then new ones.
+        """
+        pk_name = formset.model._meta.pk.name
+        rows = expand_rows(data)
+        existing = [row for row in rows if row.get(pk_name) not in (None, '')]
+        added = [row for row in rows if row.get(pk_name) in (None, '')]
+
+        pks = [row[pk_name] for row in existing]
+        queryset = self._writes(formset.model).filter(
+                **{other_model_field: instance}).filter(pk__in=pks).order_by(pk_name)
+        found = set(six.text_type(obj.pk) for obj in queryset)
+        missing = [pk for pk in pks if six.text_type(pk) not in found]
+        if missing:
+            raise ObjectDoesNotExist("%s rows %s do not exist" % (
+                _reverse_lookup(formset, other_model_field), 
+                ', '.join(str(pk) for pk in missing)))
+
+        bfs = formset.from_json(existing + added, initial_forms=len(existing), 
+                instance=instance)
+        bfs.set_queryset(queryset)
+        return bfs
 
     def is_valid(self):
-        return (self.main_form.is_valid() and all([f.is_valid() for f in list(self.o2o_forms.values())]) 
-            and all([fs.is_valid() for fs in list(self.bound_formsets.values())]))
+        """
+        Validates the group once; later calls return the remembered result
+        until new data is bound.  Stops at the first invalid form or formset,
+        so the rest are only validated if errors is asked for.
+        """
+        if self.validation_state == UNBOUND:
+            raise ValueError("Form group has no data; call deserialize first")
+        if self.validation_state == BOUND:
+            with self._stage('is_valid'):
+                for (name, _, component) in self._components():
+                    with self._stage('is_valid.' + name):
+                        valid = component.is_valid()
+                    if not valid:
+                        break
+            self.validation_state = VALID if valid else INVALID
+        return self.validation_state == VALID
 
     @property
     def errors(self):
-        form_errors = self.main_form.errors.copy()
-        for f in list(self.o2o_forms.values()):
-            form_errors[f] = f.errors
-
-        for ((reverse_lookup,_), fs) in list(self.bound_formsets.items()):
-            form_errors[reverse_lookup] = fs.errors
-
-        return form_errors
+        """
+        The errors of the main form, with the errors of each one-to-one form
+        under its field name and those of each formset under its reverse
+        lookup name.  Validates everything not yet validated, once.
+        """
+        if self._errors is None:
+            if self.validation_state == UNBOUND:
+                raise ValueError("Form group has no data; call deserialize first")
+            with self._stage('errors'):
+                form_errors = None
+                for (_, key, component) in self._components():
+                    if key is None:
+                        form_errors = component.errors.copy()
+                    else:
+                        form_errors[key] = component.errors
+                self._errors = form_errors
+            self.is_valid() # Everything is cleaned by now, so this is cheap
+        return self._errors
 
     def save(self, commit=True):
         """
         Saves the models.
 
+        If the group was created with bulk_save=True, the formset rows are
+        written with one bulk_create for the new rows, one UPDATE (per batch)
+        of just the changed fields for the changed rows and one filtered
+        delete for the deleted rows.  In that mode:
+
+            - save() is not called on formset rows and no pre_save / post_save
+              signals are sent for them.
+            - pre_delete / post_delete are still sent for deleted rows (and
+              for anything deleted by cascade), since Django only skips
+              signals on delete when nobody is listening.
+            - New rows only get their primary keys set on backends where
+              bulk_create returns them (e.g. PostgreSQL).
+            - auto_now fields of changed rows are set as save() would set
+              them, but integer version counters (see get_validator) are
+              not incremented; do that in the formset (e.g. in save_existing
+              or clean) if the group uses one.
+
         Returns:
             tuple: (main_obj, fs_objs, o2o_objs)
 
@@ -185,41 +1078,136 @@ class FormGroup(object):
         if not self.is_valid():
             raise ValidationError("Form group did not pass validation")
 
-        main_obj = self.main_form.save(commit=commit)
+        with self._stage('save'):
+            with self._stage('save.main'):
+                main_obj = self.main_form.save(commit=commit)
 
-        o2o_objs = {}
-        for (field,boundform) in list(self.o2o_forms.items()):
-            o2o_obj = boundform.save(commit=True)
-            setattr(main_obj, field, o2o_obj)
-            o2o_objs[field] = o2o_obj
+            o2o_objs = {}
+            for (field,boundform) in list(self.o2o_forms.items()):
+                with self._stage('save.o2o.' + field):
+                    o2o_obj = boundform.save(commit=True)
+                setattr(main_obj, field, o2o_obj)
+                o2o_objs[field] = o2o_obj
 
-        if commit:
-            main_obj.save()
+            if commit:
+                with self._stage('save.main.o2o_links'):
+                    main_obj.save()
 
-        self.new_fs_objects = {}
-        self.changed_fs_objects = {}
-        self.deleted_fs_objects = {}
-        for ((reverse_lookup, other_model_field), fs) in list(self.bound_formsets.items()):
+            self.new_fs_objects = {}
+            self.changed_fs_objects = {}
+            self.deleted_fs_objects = {}
+            for ((reverse_lookup, other_model_field), fs) in list(self.bound_formsets.items()):
+                with self._stage('save.formset.' + reverse_lookup):
+                    fs.instance = main_obj
+                    fs.save(commit=False)
+                    self.new_fs_objects[reverse_lookup] = fs.new_objects
+                    self.changed_fs_objects[reverse_lookup] = fs.changed_objects
+                    self.deleted_fs_objects[reverse_lookup] = fs.deleted_objects
 
-            fs.instance = main_obj
-            fs.save(commit=False)
+                    if self.bulk_save:
+                        self._bulk_save_formset(fs, other_model_field, main_obj, commit)
+                        continue
 
-            self.new_fs_objects[reverse_lookup] = fs.new_objects
-            self.changed_fs_objects[reverse_lookup] = fs.changed_objects
-            self.deleted_fs_objects[reverse_lookup] = fs.deleted_objects
+                    for fobj in fs.new_objects:
+                        setattr(fobj, other_model_field, main_obj)
+                        if commit:
+                            fobj.save()
 
-            for fobj in fs.new_objects:
-                setattr(fobj, other_model_field, main_obj)
-                if commit:
-                    fobj.save()
+                    for (fobj, changed_fields) in fs.changed_objects:
+                        setattr(fobj, other_model_field, main_obj)
+                        if commit:
+                            fobj.save()
 
-            for (fobj, changed_fields) in fs.changed_objects:
-                setattr(fobj, other_model_field, main_obj)
-                if commit:
-                    fobj.save()
+                    if commit:
+                        for fobj in fs.deleted_objects:
+                            fobj.delete()
 
-            if commit:
-                for fobj in fs.deleted_objects:
-                    fobj.delete()
+            if commit and self.content_cache is not None:
+                # The bulk paths send no signals
+                self.content_cache.invalidate(self, main_obj.pk)
+            if commit and self.read_using is not None and self.read_your_writes:
+                caches[READ_YOUR_WRITES_CACHE].set(self._written_key(main_obj.pk), True,
+                        self.read_your_writes)
+            return main_obj
+
+    def _bulk_save_formset(self, fs, other_model_field, main_obj, commit):
+        model = fs.model
+        for fobj in fs.new_objects:
+            setattr(fobj, other_model_field, main_obj)
+        for (fobj, changed_fields) in fs.changed_objects:
+            setattr(fobj, other_model_field, main_obj)
+
+        if not commit:
+            return
+
+        if fs.new_objects:
+            model._default_manager.bulk_create(fs.new_objects)
+
+        changed_fields = set()
+        for (fobj, fields) in fs.changed_objects:
+            changed_fields.update(fields)
+        # Form fields that are not model fields (e.g. extra form fields) have
+        # nothing to write.
+        model_fields = set(f.name for f in model._meta.concrete_fields)
+        changed_fields &= model_fields
+        if fs.changed_objects:
+            # As save() would: bump auto_now timestamps (e.g. a version_field)
+            auto_now = [f for f in model._meta.concrete_fields if getattr(f, 'auto_now', False)]
+            for (fobj, _) in fs.changed_objects:
+                for f in auto_now:
+                    f.pre_save(fobj, False)
+            changed_fields.update(f.name for f in auto_now)
+        bulk_update(model, [fobj for (fobj, _) in fs.changed_objects], sorted(changed_fields))
+
+        if fs.deleted_objects:
+            model._default_manager.filter(pk__in=[fobj.pk for fobj in fs.deleted_objects]).delete()
+
+def _form_initial(form_class, instance):
+    """
+    The current values of instance for the fields of a ModelForm class, as
+    form data.
+    """
+    opts = form_class._meta
+    return forms_model_to_dict(instance, fields=opts.fields, exclude=opts.exclude)
+
+def _form_class(form):
+    return form if isinstance(form, type) else form.__class__
+
+def _ordered(queryset, model):
+    """
+    queryset, ordered by primary key unless it is already ordered, as model
+    formsets expect.
+    """
+    return queryset if queryset.ordered else queryset.order_by(model._meta.pk.name)
 
-        return main_obj
+def _fetch_rows(queryset):
+    """
+    Evaluates queryset in a thread of concurrent_reads, then closes the
+    thread's database connection.
+    """
+    try:
+        len(queryset)
+        return queryset
+    finally:
+        connections[queryset.db].close()
+
+def _iter_rows(queryset, serializer, chunk_size):
+    for chunk in iter_chunks(queryset, chunk_size):
+        for m in chunk:
+            yield serializer(m)
+
+def _reverse_lookup(formset, other_model_field):
+    """
+    The name used for a formset in content and schema: the reverse accessor of
+    its ForeignKey to the main model.
+    """
+    return formset.model._meta.get_field(other_model_field).remote_field.name
+
+def _set_choices_form(form_schema, form):
+    """
+    Records which sub-form of the group lazily loaded choice fields belong to,
+    so that the client can ask for more choices.
+    """
+    for field_schema in list(form_schema.values()):
+        if isinstance(field_schema, dict) and 'choices_lazy' in field_schema:
+            field_schema['choices_lazy']['form'] = form
@@ -1,13 +1,20 @@
-import json
-from django.http import JsonResponse
-from django.db import transaction, IntegrityError
+import calendar
+from django.http import StreamingHttpResponse
+from django.db import transaction, IntegrityError, DEFAULT_DB_ALIAS
 from django.http.response import HttpResponseBadRequest
-from django.core.exceptions import ValidationError, ObjectDoesNotExist
+from django.core.exceptions import ValidationError, ObjectDoesNotExist, PermissionDenied
 from django.views.generic import TemplateView
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 
 from common.decorators import wrap_exceptions
 
 from .form_group import FormGroup
+from .forms import get_choices_page, DEFAULT_CHOICES_PAGE_SIZE
+from .streaming import iter_json
+from .codec import JsonResponse, loads
+from .schema_cache import formset_counts
+from .instrumentation import Instrument
 
 import logging
 logger = logging.getLogger(__name__)
@@ -23,20 +30,68 @@ class BaseFormGroupView(TemplateView):
         form
         create_if_no_id
         change_permission_name
+        cache_schema
+        bulk_save
+        stream_response
+        columnar_formsets
+        content_cache
+        version_field
+        schema_hash_variable
+        choices_variable
+        window_variable
+        instrument
+        server_timing
+        read_using
+        read_your_writes
+        concurrent_reads
     """
 
     # Defaults
     create_if_no_id = False
     change_permission_name = None
+    cache_schema = False
+    bulk_save = False
+    stream_response = False
+    stream_chunk_size = 2000
+    # Send formset rows as columns + row arrays; see FormGroup's columnar argument
+    columnar_formsets = False
+    # A djanx.content_cache.ContentCache for the serialized objects, if any
+    content_cache = None
+    # Timestamp or integer version field on every model in the group.  If set,
+    # GETs honour If-None-Match / If-Modified-Since; see FormGroup.get_validator.
+    version_field = None
+    schema_hash_variable = 'schema_hash'
+    choices_variable = 'choices_for'
+    window_variable = 'window_for'
+    max_window_size = 1000
+    max_choices_page_size = 500
+    # Log the time and queries of each FormGroup stage (to the
+    # djanx.instrumentation logger) and/or send them as a Server-Timing header.
+    instrument = False
+    server_timing = False
+    # Database alias for GETs (e.g. a read replica), and how many seconds after
+    # a save the saved object is read from the write database instead; see
+    # FormGroup's read_using and read_your_writes.
+    read_using = None
+    read_your_writes = 0
+    # Threads that fetch formset rows alongside the main object on a GET; see
+    # FormGroup's concurrent_reads.  Off for requests in a transaction.
+    concurrent_reads = 0
 
     @wrap_exceptions(response_class=JsonResponse)
     def get(self, request, *args, **kwargs):
+        if self.choices_variable in request.GET:
+            return self.get_choices(request)
+        if self.window_variable in request.GET:
+            return self.get_window(request)
+
         obj_id = request.GET.get(self.id_variable, None)
+        form_group = self.get_form_group()
 
         if obj_id:
             # Fill in the initial data
             try:
-                obj = self.form.Meta.model.objects.get(id=obj_id)
+                obj = form_group.get_object(obj_id)
             except ObjectDoesNotExist:
                 logging.error("%s got request for id %s which does not exist" % 
                         (self.__class__.__name__, obj_id))
@@ -47,12 +102,59 @@ class BaseFormGroupView(TemplateView):
             else:
                 raise ObjectDoesNotExist("No %s id given" % self.noun.lower())
 
-        form_group = FormGroup(self.form)
+        validator = None
+        if obj is not None and self.version_field:
+            validator = form_group.get_validator(obj, self.version_field)
+        if validator:
+            etag, last_modified = validator
+            if last_modified is not None:
+                last_modified = calendar.timegm(last_modified.utctimetuple())
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is not None:
+                return response
+
+        response = self._serialize_response(form_group, obj, 
+                request.GET.get(self.schema_hash_variable, None))
+        self._report(form_group, response, view=self.__class__.__name__, obj_id=obj_id)
+        if validator:
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            # Make browsers revalidate instead of reusing stale groups
+            response['Cache-Control'] = 'no-cache'
+        return response
+
+    def _serialize_response(self, form_group, obj, known_hash=None):
+        """
+        If known_hash (sent by the client as schema_hash_variable) matches the
+        schema, the schema is left out and only its per-request part is sent,
+        as 'formset_counts', along with 'schema_hash'.  Schemas only have a
+        hash with cache_schema.
+        """
+        if self.stream_response:
+            contents, schema, order = form_group.serialize_stream(obj, 
+                    chunk_size=self.stream_chunk_size)
+        else:
+            contents, schema, order = form_group.serialize(obj)
+
+        extra = {}
+        if known_hash and known_hash == schema.get('hash_'):
+            extra = {'schema_hash': known_hash, 'formset_counts': formset_counts(schema)}
+            schema = None
 
-        contents, schema, order = form_group.serialize(obj)
+        if self.stream_response:
+            # Errors part way through can no longer change the response, so
+            # wrap_exceptions only covers what happens before streaming starts.
+            return StreamingHttpResponse(
+                    iter_json(contents, schema, order, chunk_size=self.stream_chunk_size,
+                        extra=extra),
+                    content_type='application/json', status=200)
 
-        return JsonResponse({'contents': contents, 'schema': schema, 'order': order},
-                status=200)
+        data = {'contents': contents, 'order': order}
+        if schema is not None:
+            data['schema'] = schema
+        data.update(extra)
+        return JsonResponse(data, status=200)
 
     @wrap_exceptions(response_class=JsonResponse)
     @transaction.atomic
@@ -64,6 +166,21 @@ class BaseFormGroupView(TemplateView):
 
         If failed, response contains a dictionary mapping field names to errors.
         """
+        return self._save(request, delta=False)
+
+    @wrap_exceptions(response_class=JsonResponse)
+    @transaction.atomic
+    def patch(self, request, *args, **kwargs):
+        """
+        Modify an existing object from a partial update: only the changed main
+        fields and the added, changed and deleted formset rows.  See
+        FormGroup.deserialize_delta for the format.
+
+        Responses are as for post.
+        """
+        return self._save(request, delta=True)
+
+    def _save(self, request, delta):
         if not request.is_ajax():
             return HttpResponseBadRequest('Expected an XMLHttpRequest')
 
@@ -73,20 +190,97 @@ class BaseFormGroupView(TemplateView):
                 raise PermissionDenied("Sorry, you are not permitted to add or change a %s"
                         % self.__class__.__name__)
 
-        in_data = json.loads(request.body)
+        in_data = loads(request.body)
         logger.info("in_data: %s" % in_data)
 
-        form_group = FormGroup(self.form)
-        form_group.deserialize(in_data)
+        form_group = self.get_form_group()
+        if delta:
+            form_group.deserialize_delta(in_data)
+        else:
+            form_group.deserialize(in_data)
 
         if form_group.is_valid():
             obj = form_group.save(commit=True)
             self.post_save(obj)
             message = "Saved %s" % self.noun.lower()
-            return JsonResponse({'message': message, 'id': obj.id}, status=200)
+            response = JsonResponse({'message': message, 'id': obj.id}, status=200)
         else:
             logger.error(form_group.errors)
-            return JsonResponse({'form_errors': form_group.errors}, status=400)
+            response = JsonResponse({'form_errors': form_group.errors}, status=400)
+        self._report(form_group, response, view=self.__class__.__name__, 
+                obj_id=in_data.get('id', None))
+        return response
+
+    def get_choices(self, request):
+        """
+        Serves a page of choices for a field listed in the form's
+        Meta.lazy_choices.  The client passes the field name as
+        choices_variable and, for formset and one-to-one fields, the 'form'
+        entry of the choices_lazy descriptor as choices_form.  Optional
+        parameters: search, offset, limit, after (keyset) and pks
+        (comma separated).
+        """
+        form_group = self.get_form_group()
+        formfield, options = form_group.get_lazy_choices_field(
+                request.GET[self.choices_variable], request.GET.get('choices_form', None))
+
+        limit = min(int(request.GET.get('limit', 
+            options.get('page_size', DEFAULT_CHOICES_PAGE_SIZE))), self.max_choices_page_size)
+        pks = request.GET.get('pks', None)
+        page = get_choices_page(formfield, search=request.GET.get('search', None),
+                search_fields=options.get('search_fields', ()),
+                offset=int(request.GET.get('offset', 0)), limit=limit,
+                after=request.GET.get('after', None),
+                pks=pks.split(',') if pks else None, using=form_group.read_using)
+        return JsonResponse(page, status=200)
+
+    def get_window(self, request):
+        """
+        Serves a further window of rows for a formset that sets window_size.
+        The client passes the object id as id_variable, the formset's name as
+        window_variable and the 'next_after' of the last window as after.
+        Optional parameter: limit.  See FormGroup.get_window.
+        """
+        obj_id = request.GET.get(self.id_variable, None)
+        if not obj_id:
+            raise ObjectDoesNotExist("No %s id given" % self.noun.lower())
+        limit = request.GET.get('limit', None)
+        if limit is not None:
+            limit = min(int(limit), self.max_window_size)
+        window = self.get_form_group().get_window(obj_id, request.GET[self.window_variable],
+                after=request.GET.get('after', None), limit=limit)
+        return JsonResponse(window, status=200)
+
+    def get_form_group(self):
+        """
+        Hook for sub classes that need formsets or one-to-one forms.
+        """
+        instrument = None
+        if self.instrument or self.server_timing:
+            # GETs run their queries on read_using
+            using = DEFAULT_DB_ALIAS
+            if self.read_using and self.request.method == 'GET':
+                using = self.read_using
+            instrument = Instrument(using=using)
+        return FormGroup(self.form, cache_schema=self.cache_schema,
+                bulk_save=self.bulk_save, columnar=self.columnar_formsets,
+                content_cache=self.content_cache, instrument=instrument,
+                read_using=self.read_using, read_your_writes=self.read_your_writes,
+                concurrent_reads=self.concurrent_reads)
+
+    def _report(self, form_group, response, **extra):
+        """
+        Logs form_group's stages and/or adds them to response as a
+        Server-Timing header.  For streamed responses only the work done
+        before streaming started is included.
+        """
+        instrument = getattr(form_group, 'instrument', None)
+        if instrument is None:
+            return
+        if self.server_timing:
+            response['Server-Timing'] = instrument.server_timing()
+        if self.instrument:
+            instrument.log(**extra)
 
     def post_save(self, obj):
         """
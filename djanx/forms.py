@@ -1,9 +1,20 @@
 from django import forms as djforms
 from django.utils import timezone, six
-from django.core.exceptions import ValidationError
+from django.core.exceptions import ValidationError, ImproperlyConfigured
 from django.contrib.postgres.forms import jsonb
 from django.utils.translation import ugettext_lazy as _
-import dateutil
+import functools, operator, collections, copy
+from django.core.exceptions import FieldDoesNotExist, NON_FIELD_ERRORS
+from django.db import models, connection, connections, router
+from django.db.models import F, Q
+from django.db.models.query import QuerySet
+
+from .utils import parse_iso_datetime
+from . import codec
+
+# Page size for lazily loaded ModelChoiceField choices, unless the field's
+# entry in Meta.lazy_choices says otherwise.
+DEFAULT_CHOICES_PAGE_SIZE = 50
 
 # TODO: initial data from model/queryset
 
@@ -20,46 +31,118 @@ class DjanxForm(object):
         except AttributeError:
             hidden_fields = set()
 
-        try:
-            static_data = cls.Meta.static
-        except AttributeError:
-            static_data = {}
-        return _create_schema(cls.base_fields, hidden_fields, static_data)
+        return _create_schema(cls.base_fields, hidden_fields, get_static_data(cls),
+                get_lazy_choices(cls))
 
 
-    def get_schema(self):
+    def get_schema(self, using=None):
         """
         Returns a JSON representation of the django model, based on the 
-        concrete fields of the form instance.
+        concrete fields of the form instance.  Choices are read from the
+        database alias using if given.
         """
         try:
             hidden_fields = set(self.Meta.hidden)
         except AttributeError:
             hidden_fields = set()
 
-        try:
-            static_data = self.Meta.static
-        except AttributeError:
-            static_data = {}
-        return _create_schema(self.fields, hidden_fields, static_data)
+        return _create_schema(self.fields, hidden_fields, get_static_data(self),
+                get_lazy_choices(self), using)
 
 
-    def get_static(self, obj):
-        try:
-            static_data = self.Meta.static
-        except AttributeError:
-            static_data = {}
+    def get_static(self, obj, using=None):
+        return get_static(self, obj, using)
+
+def get_static_data(form):
+    """
+    Returns the form's Meta.static: a dict mapping static names to specs,
+    whose 'field' entry is the lookup of the value.
+
+    Raises:
+        ImproperlyConfigured if a static name is also the name of a form field.
+    """
+    try:
+        static_data = form.Meta.static
+    except AttributeError:
+        return {}
+    clashes = set(static_data) & set(form.base_fields)
+    if clashes:
+        raise ImproperlyConfigured("%s Meta.static names %s are also form fields" % (
+            _form_name(form), ', '.join(sorted(clashes))))
+    return static_data
+
+def _form_name(form):
+    return form.__name__ if isinstance(form, type) else form.__class__.__name__
+
+def get_static(form, obj, using=None):
+    """
+    Returns the values of the form's Meta.static fields for obj, a dict
+    mapping each static name to the value of its 'field' lookup.
 
-        objs_qs = obj._meta.model.objects.filter(pk=obj.pk) # one object
-        fields = [sd['field'] for sd in list(static_data.values())]
-        rawdata = objs_qs.values(*fields)[0]
-        return {k: rawdata[v['field']] for (k,v) in list(static_data.items())}
+    If obj was loaded from a queryset passed through annotate_static the
+    values are read from its annotations; otherwise they take one query, on
+    the database alias using if given.
+    """
+    static_data = get_static_data(form)
+    if not static_data:
+        return {}
+    values = get_annotated_static(form, obj)
+    if values is not None:
+        return values
+
+    objs_qs = obj._meta.model.objects.using(using).filter(pk=obj.pk) # one object
+    fields = [sd['field'] for sd in list(static_data.values())]
+    rawdata = objs_qs.values(*fields)[0]
+    return {k: rawdata[v['field']] for (k,v) in list(static_data.items())}
+
+def get_annotated_static(form, obj):
+    """
+    Like get_static, but only reads the annotations of objects loaded through
+    annotate_static: for other objects it returns None instead of querying.
+    """
+    static_data = get_static_data(form)
+    aliases = [(k, _static_alias(k)) for k in static_data]
+    if not all(hasattr(obj, alias) for (k, alias) in aliases):
+        return None
+    return {k: getattr(obj, alias) for (k, alias) in aliases}
+
+def annotate_static(queryset, form):
+    """
+    Annotates the form's Meta.static lookups onto queryset, so that
+    get_static needs no further queries for the objects it returns.  The
+    lookups should be single valued (fields of the model or of objects it
+    has a ForeignKey to); multi-valued lookups would repeat objects.
+    """
+    static_data = get_static_data(form)
+    if not static_data:
+        return queryset
+    return queryset.annotate(**{_static_alias(k): F(v['field']) 
+        for (k, v) in list(static_data.items())})
+
+def _static_alias(name):
+    return 'djanx_static_%s' % name
+
+def get_lazy_choices(form):
+    """
+    Returns the form's Meta.lazy_choices: a dict mapping field name to options
+    for ModelChoiceFields whose choices are paged in by the client rather than
+    sent in full with the schema.  Options are:
+
+        search_fields: model fields to search (icontains) when the client
+        sends a search string.
+
+        page_size: number of choices per page (DEFAULT_CHOICES_PAGE_SIZE).
+    """
+    try:
+        return form.Meta.lazy_choices
+    except AttributeError:
+        return {}
 
-def _create_schema(fields, hidden_fields, static_data):
+def _create_schema(fields, hidden_fields, static_data, lazy_choices={}, using=None):
     result = {}
     for (fname, formfield) in list(fields.items()):
 
-        field_schema = get_formfield_schema(formfield)
+        field_schema = get_formfield_schema(formfield, lazy_choices.get(fname), using)
         field_schema['name'] = fname
         field_schema['hidden'] = (fname in hidden_fields)
         result[fname] = field_schema
@@ -77,14 +160,30 @@ def _create_schema(fields, hidden_fields, static_data):
 
 class DjanxFormSetMixin(object):
 
+    # Resolve the submitted values of ModelChoiceFields for all rows with one
+    # query per field before the forms are cleaned.
+    prefetch_choices = True
+
+    # Check unique / unique_together against the database with one query per
+    # constraint for the whole formset, instead of per row.
+    batch_unique_checks = True
+
+    # If set, FormGroup sends existing rows window_size at a time and only the
+    # rows the client sends back are saved; see FormGroup.get_window.
+    window_size = None
+
     @classmethod
     def from_json(cls, data, initial_forms=0, *args, **kwargs):
         """
         Takes a list of forms derived from JSON as the data object and converts
         into the prefix style expected by the FormSet constructor
 
+        data may also be in the columnar form that FormGroup sends when
+        created with columnar=True: {'columns': [...], 'rows': [[...], ...]}.
+
         Note - the initial_forms argument is important! 
         """
+        data = expand_rows(data)
         flatdata = {}
         prefix = kwargs['prefix'] if 'prefix' in kwargs else cls.get_default_prefix()
         for (i,formobj) in enumerate(data):
@@ -95,26 +194,340 @@ class DjanxFormSetMixin(object):
         return cls(flatdata, *args, **kwargs)
 
 
-    def get_schema(self):
+    def full_clean(self):
+        if self.is_bound and self.prefetch_choices:
+            self._prefetch_choices()
+        super(DjanxFormSetMixin, self).full_clean()
+
+    def _construct_form(self, i, **kwargs):
+        form = super(DjanxFormSetMixin, self)._construct_form(i, **kwargs)
+        if self.batch_unique_checks:
+            _defer_unique_checks(form)
+        return form
+
+    def validate_unique(self):
+        """
+        Django's checks for duplicates between the submitted rows, then the
+        database checks that the rows' own validate_unique would have done,
+        batched per constraint.  Errors are added to the offending rows just
+        as the per-row checks would add them.
+        """
+        super(DjanxFormSetMixin, self).validate_unique()
+        if not self.batch_unique_checks:
+            return
+
+        forms_to_delete = self.deleted_forms
+        checks = collections.OrderedDict() # (model_class, unique_check) -> [(form, values)]
+        for form in self.forms:
+            if not form.is_valid() or form in forms_to_delete:
+                continue
+            instance = form.instance
+            unique_checks, _ = instance._get_unique_checks(
+                    exclude=form._get_validation_exclusions())
+            for (model_class, unique_check) in unique_checks:
+                values = _unique_lookup_values(instance, unique_check)
+                if values is not None:
+                    checks.setdefault((model_class, tuple(unique_check)), []).append(
+                            (form, values))
+
+        for ((model_class, unique_check), rows) in list(checks.items()):
+            existing = _existing_unique_values(model_class, unique_check, 
+                    [row[1] for row in rows])
+            for (form, values) in rows:
+                instance = form.instance
+                pks = existing.get(values, set())
+                if not instance._state.adding:
+                    pks = pks - set([instance._get_pk_val(model_class._meta)])
+                if pks:
+                    key = unique_check[0] if len(unique_check) == 1 else NON_FIELD_ERRORS
+                    form._update_errors(ValidationError({key: 
+                        [instance.unique_error_message(model_class, unique_check)]}))
+
+    def _prefetch_choices(self):
+        """
+        ModelChoiceField.clean looks each value up with queryset.get(), and
+        model validation of a ForeignKey checks again that the value exists;
+        both cost a query per row.  Instead collect the values submitted for
+        each field across all forms, fetch them with one IN query, and give
+        the fields a queryset whose get() answers from those rows.  The
+        ForeignKey existence check is likewise done once for all rows.
+
+        The rows are fetched with the queryset of an unbound form's field
+        (see get_schema_form, plus the fields the formset adds, such as the
+        primary key's), so narrowing done in the form's __init__ applies, but
+        not narrowing that differs per row (e.g. by instance); set
+        prefetch_choices = False for such forms.  Forms whose field reads
+        another model or database are left to the per-row lookups.
+        """
+        reference = self.get_schema_form()
+        self.add_fields(reference, None)
+        groups = collections.OrderedDict() # name -> (queryset, forms, values)
+        for (name, field) in list(reference.fields.items()):
+            if (isinstance(field, djforms.ModelChoiceField) and 
+                    not isinstance(field, djforms.ModelMultipleChoiceField)):
+                groups[name] = (field.queryset, [], set())
+        for form in self.forms:
+            for (name, (reference_qs, forms, values)) in list(groups.items()):
+                field = form.fields.get(name)
+                if (not isinstance(field, djforms.ModelChoiceField) 
+                        or field.queryset.model is not reference_qs.model
+                        or field.queryset.db != reference_qs.db):
+                    continue
+                forms.append(form)
+                value = field.widget.value_from_datadict(form.data, form.files, 
+                        form.add_prefix(name))
+                if value not in field.empty_values:
+                    values.add(value)
+
+        for (name, (reference_qs, forms, values)) in list(groups.items()):
+            if len(forms) < 2:
+                continue
+            field = forms[0].fields[name]
+            queryset = PrefetchedQuerySet.prefetch(reference_qs, 
+                    field.to_field_name or 'pk', values)
+            for form in forms:
+                form.fields[name].queryset = queryset
+
+            try:
+                fk = self.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if (isinstance(fk, models.ForeignKey) and not fk.remote_field.parent_link
+                    and fk.remote_field.model is queryset.model):
+                target = fk.remote_field.field_name
+                keys = [getattr(obj, fk.target_field.attname) 
+                        for obj in list(queryset._prefetched[1].values())]
+                existing = set(fk.remote_field.model._default_manager
+                        .filter(**{target+'__in': keys})
+                        .complex_filter(fk.get_limit_choices_to())
+                        .values_list(target, flat=True))
+                for form in forms:
+                    _skip_fk_exists(form.instance, fk, existing)
+
+    def get_schema(self, using=None):
         """
         Returns a JSON representation of the django model.
         """
-        management_form = self.management_form
+        schema = self.get_static_schema(using)
+        schema.update(self.get_count_schema())
+        return schema
 
+    def get_static_schema(self, using=None):
+        """
+        The part of get_schema that does not depend on the formset's data, and
+        so can be cached per formset class.  Choices are read from the
+        database alias using if given.
+        """
+        lazy_choices = get_lazy_choices(self.form)
         form_schema = {}
-        for (fname, formfield) in list(self.form.base_fields.items()):
+        for (fname, formfield) in list(self.get_schema_form().fields.items()):
 
-            field_schema = get_formfield_schema(formfield)
+            field_schema = get_formfield_schema(formfield, lazy_choices.get(fname), using)
             field_schema['name'] = fname
             form_schema[fname] = field_schema
 
         return {'prefix': self.prefix, 'form': form_schema, 
                 'fields': list(self.form.base_fields.keys()),
-                'total_forms': self.total_form_count(),
-                'initial_forms': self.initial_form_count(), 
                 'max_num_forms': self.max_num, 'min_num_forms': self.min_num ,
                 'type_': 'formset'}
 
+    def get_schema_form(self):
+        """
+        A form instance whose fields the schema describes, so that narrowing
+        of their querysets done in the form's __init__ applies to the choices.
+        Unlike the formset's forms it has none of the fields the formset adds.
+        """
+        return self.form(**self.get_form_kwargs(None))
+
+    def get_count_schema(self, initial_forms=None):
+        """
+        The per-request part of get_schema.
+
+        If initial_forms is given (e.g. from a COUNT query) it is used instead
+        of fetching the formset's queryset.
+        """
+        if initial_forms is None:
+            management_form = self.management_form
+            return {'total_forms': self.total_form_count(),
+                    'initial_forms': self.initial_form_count()}
+
+        # Same rules as BaseFormSet.total_form_count for an unbound formset
+        total_forms = max(initial_forms, self.min_num) + self.extra
+        if initial_forms > self.max_num >= 0:
+            total_forms = initial_forms
+        elif total_forms > self.max_num >= 0:
+            total_forms = self.max_num
+        return {'total_forms': total_forms, 'initial_forms': initial_forms}
+
+    def set_queryset(self, queryset):
+        """
+        Makes the formset use queryset as is for its existing objects, so that
+        rows that were already fetched (e.g. by FormGroup.deserialize) are not
+        fetched again.  queryset must be ordered; call before using the forms.
+        """
+        self._queryset = queryset
+
+def expand_rows(data):
+    """
+    Returns formset rows as a list of dicts, whether data is such a list or
+    in the columnar form {'columns': [...], 'rows': [[...], ...]}.
+    """
+    if isinstance(data, dict):
+        columns = data['columns']
+        return [dict(zip(columns, row)) for row in data['rows']]
+    return data
+
+def _defer_unique_checks(form):
+    """
+    Replaces form.validate_unique so that it only runs the unique_for_date
+    style checks; DjanxFormSetMixin.validate_unique does the rest for all rows
+    at once.
+    """
+    def validate_unique():
+        exclude = form._get_validation_exclusions()
+        _, date_checks = form.instance._get_unique_checks(exclude=exclude)
+        errors = form.instance._perform_date_checks(date_checks)
+        if errors:
+            form._update_errors(ValidationError(errors))
+    form.validate_unique = validate_unique
+
+def _unique_lookup_values(instance, unique_check):
+    """
+    The values of instance for a unique check, or None if Model.validate_unique
+    would skip the check (a missing value, or the pk of a saved object).
+    """
+    values = []
+    for field_name in unique_check:
+        f = instance._meta.get_field(field_name)
+        value = getattr(instance, f.attname)
+        if (value is None or 
+                (value == '' and connection.features.interprets_empty_strings_as_nulls)):
+            return None
+        if f.primary_key and not instance._state.adding:
+            return None
+        values.append(value)
+    return tuple(values)
+
+def _existing_unique_values(model_class, unique_check, rows, batch_size=None):
+    """
+    Looks up which of the value tuples in rows already exist for unique_check.
+
+    The rows found are matched back to the value tuples in Python.  If the
+    database matched a row that equals none of the tuples (e.g. under a case
+    or padding insensitive collation, or a value stored in another type), the
+    tuples of that batch are looked up again one query each, as the per-row
+    checks would.
+
+    Returns:
+        dict: value tuple -> set of pks of the existing objects
+    """
+    result = collections.defaultdict(set)
+    attnames = [model_class._meta.get_field(name).attname for name in unique_check]
+    manager = model_class._default_manager
+    rows = list(set(rows))
+    # Each row takes a query parameter per field of unique_check
+    db = router.db_for_read(model_class)
+    max_batch_size = max(connections[db].ops.bulk_batch_size(list(unique_check), rows), 1)
+    batch_size = min(batch_size, max_batch_size) if batch_size else max_batch_size
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start+batch_size]
+        if len(unique_check) == 1:
+            condition = Q(**{unique_check[0]+'__in': [values[0] for values in batch]})
+        else:
+            condition = functools.reduce(operator.or_, 
+                    [Q(**dict(zip(unique_check, values))) for values in batch])
+        found = collections.defaultdict(set)
+        for row in manager.filter(condition).values_list('pk', *attnames):
+            found[tuple(row[1:])].add(row[0])
+        if set(found) <= set(batch):
+            result.update(found)
+            continue
+        for values in batch:
+            pks = manager.filter(**dict(zip(unique_check, values))).values_list('pk', flat=True)
+            result[values].update(pks)
+    return result
+
+def _skip_fk_exists(instance, fk, existing):
+    """
+    Replaces instance.clean_fields so that ForeignKey fk is validated without
+    its existence query when its value is one of existing (already checked
+    with the same conditions).  The field's other checks and validators still
+    run, and errors are reported as Model.clean_fields would.
+    """
+    clean_fields = instance.clean_fields
+
+    def _clean_fields(exclude=None):
+        exclude = list(exclude or [])
+        value = getattr(instance, fk.attname)
+        if fk.name in exclude or value not in existing:
+            return clean_fields(exclude=exclude)
+
+        errors = {}
+        try:
+            clean_fields(exclude=exclude + [fk.name])
+        except ValidationError as e:
+            errors = e.update_error_dict(errors)
+        try:
+            models.Field.validate(fk, value, instance)
+            fk.run_validators(value)
+        except ValidationError as e:
+            errors[fk.name] = e.error_list
+        if errors:
+            raise ValidationError(errors)
+
+    instance.clean_fields = _clean_fields
+
+class PrefetchedQuerySet(QuerySet):
+    """
+    A QuerySet whose get() for a single key lookup is answered from rows
+    fetched in advance by prefetch().  Values that were not fetched do not
+    exist, as far as get() is concerned.  Anything else (including clones)
+    behaves like a normal QuerySet.
+    """
+
+    _prefetched = None
+
+    @classmethod
+    def prefetch(cls, queryset, key, values):
+        result = cls(model=queryset.model, query=queryset.query.clone(), 
+                using=queryset._db, hints=queryset._hints)
+        keys = []
+        for value in values:
+            try:
+                keys.extend(result._to_python(key, [value]))
+            except ValueError:
+                pass # get() will reject it again, making it an invalid choice
+        model_field = result._key_field(key)
+        result._prefetched = (key, {getattr(obj, model_field.attname): obj
+                for obj in queryset.filter(**{key+'__in': keys})})
+        return result
+
+    def get(self, *args, **kwargs):
+        if self._prefetched is None or args or len(kwargs) != 1:
+            return super(PrefetchedQuerySet, self).get(*args, **kwargs)
+        (key, objs) = self._prefetched
+        if key not in kwargs:
+            return super(PrefetchedQuerySet, self).get(*args, **kwargs)
+        try:
+            return objs[self._to_python(key, [kwargs[key]])[0]]
+        except KeyError:
+            raise self.model.DoesNotExist(
+                    "%s matching query does not exist." % self.model._meta.object_name)
+
+    def _key_field(self, key):
+        return self.model._meta.pk if key == 'pk' else self.model._meta.get_field(key)
+
+    def _to_python(self, key, values):
+        """
+        Converts submitted values the way the database lookup would, raising
+        ValueError for values it would reject.
+        """
+        model_field = self._key_field(key)
+        try:
+            return [model_field.to_python(v) for v in values]
+        except ValidationError as e:
+            raise ValueError(e)
+
 class DjanxModelFormSet(DjanxFormSetMixin, djforms.BaseModelFormSet):
     pass
 
@@ -124,31 +537,141 @@ class DjanxInlineFormSet(DjanxFormSetMixin, djforms.BaseInlineFormSet):
 class DjanxFormSet(DjanxFormSetMixin, djforms.BaseModelFormSet):
     pass
 
-def get_formfield_schema(formfield):
+# Form field attributes described in field schemas
+FIELD_SCHEMA_ATTRS = ('help_text', 'disabled', 'label', 'label_suffix', 'initial', 
+        'required', 'max_value', 'min_value', 'max_length')
+
+_field_classes = {} # form field class -> (class name, attribute names, getter, has choices)
+
+def _field_class_info(formfield):
+    field_class = formfield.__class__
+    try:
+        return _field_classes[field_class]
+    except KeyError:
+        pass
+    # Instances of a field class are assumed to share their attributes
+    attr_names = tuple(attr for attr in FIELD_SCHEMA_ATTRS if hasattr(formfield, attr))
+    if len(attr_names) == 1:
+        getter = lambda f, attr=attr_names[0]: (getattr(f, attr),)
+    elif attr_names:
+        getter = operator.attrgetter(*attr_names)
+    else:
+        getter = lambda f: ()
+    info = _field_classes[field_class] = (field_class.__name__, attr_names, getter,
+            hasattr(formfield, 'choices'))
+    return info
+
+def get_formfield_schema(formfield, lazy_choices=None, using=None):
+    """
+    Args:
+        formfield (Field): the form field to describe.
 
-    result = {'class': formfield.__class__.__name__}
+        lazy_choices (dict or None): if given and formfield is a
+        ModelChoiceField, the choices are not enumerated.  Instead the schema
+        gets a 'choices_lazy' descriptor and only the first page of choices.
+        See get_lazy_choices for the options.
 
-    for attr in ('help_text', 'disabled', 'label', 'label_suffix', 'initial', 
-            'required', 'max_value', 'min_value', 'max_length'):
-        try:
-            result[attr] = getattr(formfield, attr)
-        except AttributeError:
-            pass
+        using (str or None): the database alias to read a ModelChoiceField's
+        choices from, instead of its queryset's own.
 
-    if hasattr(formfield, 'choices') and formfield.choices:
-        result['choices'] = [{'pk': t[0], 'text': t[1]} for t in formfield.choices]
+    Returns:
+        dict
+    """
+    info = _field_class_info(formfield)
+    result = {'class': info[0], 'type_': 'field'}
+    result.update(zip(info[1], info[2](formfield)))
+
+    if lazy_choices is not None and isinstance(formfield, djforms.ModelChoiceField):
+        page_size = lazy_choices.get('page_size', DEFAULT_CHOICES_PAGE_SIZE)
+        page = get_choices_page(formfield, limit=page_size, using=using)
+        result['choices'] = list(page['choices'])
+        if formfield.empty_label is not None:
+            result['choices'].insert(0, {'pk': '', 'text': formfield.empty_label})
+        # 'form' is filled in by FormGroup for formset and one-to-one fields
+        result['choices_lazy'] = {'form': None, 'page_size': page_size,
+                'searchable': bool(lazy_choices.get('search_fields')),
+                'has_more': page['has_more'], 'next_after': page['next_after'],
+                'offset': len(page['choices'])}
+    elif info[3]:
+        choices = formfield.choices
+        if using is not None and isinstance(formfield, djforms.ModelChoiceField):
+            choices = _using(formfield, using).choices
+        if choices:
+            result['choices'] = [{'pk': t[0], 'text': t[1]} for t in choices]
         #{'pk': m.pk, 'text': str(m)} 
                 #for m in formfield.queryset]
-    result['type_'] = 'field'
     return result
 
+def _using(formfield, using):
+    """
+    A copy of the ModelChoiceField formfield whose choices are read from the
+    database alias using.  Copied, since forms share their base_fields.
+    """
+    formfield = copy.deepcopy(formfield)
+    formfield.queryset = formfield.queryset.using(using)
+    return formfield
+
+def get_choices_page(formfield, search=None, search_fields=(), offset=0,
+        limit=DEFAULT_CHOICES_PAGE_SIZE, after=None, pks=None, using=None):
+    """
+    Returns one page of choices from a ModelChoiceField's queryset.
+
+    Args:
+        search (str): if given, only rows where one of search_fields contains
+        it (case insensitive) are returned.
+
+        offset, limit: limit/offset pagination.
+
+        after: keyset pagination.  If given, the rows are ordered by the
+        field's key (to_field_name or pk) and only those after this value are
+        returned; offset is ignored.  Prefer this for deep pages.
+
+        pks (list): if given, only these keys are returned.  Used by the client
+        to look up the labels of the currently selected values.
+
+        using (str or None): the database alias to read from, instead of the
+        queryset's own.
+
+    Returns:
+        dict: {'choices': [{'pk':..., 'text':...}], 'has_more': bool,
+        'next_after': key of the last row, for the next keyset request, or
+        None if the queryset's ordering rules out keyset pagination}
+    """
+    key = formfield.to_field_name or 'pk'
+    qs = formfield.queryset
+    if using is not None:
+        qs = qs.using(using)
+
+    if pks is not None:
+        qs = qs.filter(**{key+'__in': pks})
+    if search and search_fields:
+        qs = qs.filter(functools.reduce(operator.or_,
+            [Q(**{f+'__icontains': search}) for f in search_fields]))
+
+    # Keyset pagination only works if the rows are ordered by key; querysets
+    # with their own ordering are paged by offset.
+    keyset = after is not None or not qs.ordered
+    if after is not None:
+        qs = qs.order_by(key).filter(**{key+'__gt': after})
+        offset = 0
+    elif keyset:
+        qs = qs.order_by(key)
+
+    rows = list(qs[offset:offset+limit+1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {'choices': [{'pk': formfield.prepare_value(m), 'text': formfield.label_from_instance(m)}
+                for m in rows],
+            'has_more': has_more,
+            'next_after': formfield.prepare_value(rows[-1]) if rows and keyset else None}
+
 ######################################
 # Djanx versions of builtin form fields
 ######################################
 
 class DateField(djforms.DateField):
     def strptime(self, value, format):
-        return dateutil.parser.parse(value).date()
+        return parse_iso_datetime(value).date()
 
     #def value_to_string(self, obj):
     #    print "VALUE TO STRING!!!"
@@ -185,7 +708,7 @@ class JSONField(jsonb.JSONField):
         elif isinstance(value, (list, dict, int, float, JSONString)):
             return value
         try:
-            converted = json.loads(value)
+            converted = codec.loads(value)
         except ValueError:
             raise djforms.ValidationError(
                 self.error_messages['invalid'],
@@ -201,11 +724,11 @@ class JSONField(jsonb.JSONField):
         if self.disabled:
             return initial
         try:
-            return json.loads(data)
+            return codec.loads(data)
         except ValueError:
             return InvalidJSONInput(data)
 
     def prepare_value(self, value):
         if isinstance(value, InvalidJSONInput):
             return value
-        return json.dumps(value)
+        return codec.dumps(value)
@@ -0,0 +1,141 @@
+import collections, time, logging
+from django.db import connections, DEFAULT_DB_ALIAS
+
+logger = logging.getLogger(__name__)
+
+timer = getattr(time, 'perf_counter', time.time)
+
+# duration is in seconds; queries is the number of queries run on the
+# Instrument's database during the stage (including nested stages).
+Stage = collections.namedtuple('Stage', ['name', 'duration', 'queries'])
+
+class Instrument(object):
+    """
+    Records the wall time and query count of the stages of a FormGroup's work
+    (see the stage names in FormGroup), for one request or so.
+
+    Pass one to FormGroup(instrument=...); without one, FormGroup skips all of
+    this.  callback, if given, is called with each Stage as it ends; the
+    stages are also kept in stages, in the order they ended.
+
+    Queries are counted with connection.execute_wrapper on Django 2.0 and
+    later.  Before that the debug cursor is turned on while a stage runs and
+    its query log is swapped for one that counts what is added to it.
+    """
+
+    def __init__(self, callback=None, using=DEFAULT_DB_ALIAS):
+        self.callback = callback
+        self.using = using
+        self.stages = []
+        self._outer = [] # The stages that were not nested in another
+        self._depth = 0
+        self._queries = 0
+
+    def stage(self, name):
+        return _StageContext(self, name)
+
+    def total(self):
+        """
+        Returns the sum of the outermost stages as a Stage named 'total'.
+        """
+        return Stage('total', sum(s.duration for s in self._outer), 
+                sum(s.queries for s in self._outer))
+
+    def server_timing(self):
+        """
+        Returns the stages as a Server-Timing header value.
+        """
+        return ', '.join('%s;dur=%.1f;desc="%d queries"' % (s.name, s.duration * 1000, s.queries)
+                for s in self.stages)
+
+    def log(self, message='form group timings', level=logging.INFO, **extra):
+        """
+        Logs the stages as one structured record: the stages are in the
+        record's djanx_stages attribute, as dicts, along with extra.
+        """
+        if not logger.isEnabledFor(level):
+            return
+        total = self.total()
+        extra['djanx_stages'] = [s._asdict() for s in self.stages]
+        logger.log(level, '%s: %.1f ms, %d queries', message, total.duration * 1000,
+                total.queries, extra=extra)
+
+    def _query_count(self):
+        return self._queries
+
+    def _start(self):
+        if self._depth == 0:
+            connection = connections[self.using]
+            if hasattr(connection, 'execute_wrapper'):
+                self._wrapper = connection.execute_wrapper(self._count_query)
+                self._wrapper.__enter__()
+            else:
+                self._force_debug_cursor = connection.force_debug_cursor
+                connection.force_debug_cursor = True
+                # Not len(queries_log): the log stops growing once full
+                self._queries_log = connection.queries_log
+                connection.queries_log = _CountingLog(self, self._queries_log)
+        self._depth += 1
+
+    def _stop(self):
+        self._depth -= 1
+        if self._depth == 0:
+            connection = connections[self.using]
+            if hasattr(connection, 'execute_wrapper'):
+                self._wrapper.__exit__(None, None, None)
+            else:
+                connection.force_debug_cursor = self._force_debug_cursor
+                log, connection.queries_log = connection.queries_log, self._queries_log
+                self._queries_log.clear()
+                self._queries_log.extend(log)
+
+    def _count_query(self, execute, sql, params, many, context):
+        self._queries += 1
+        return execute(sql, params, many, context)
+
+    def _record(self, stage):
+        self.stages.append(stage)
+        if self._depth == 0:
+            self._outer.append(stage)
+        if self.callback is not None:
+            self.callback(stage)
+
+class _CountingLog(collections.deque):
+    """ A connection's queries_log that counts the queries logged to it """
+
+    def __init__(self, instrument, log):
+        super(_CountingLog, self).__init__(log, log.maxlen)
+        self.instrument = instrument
+
+    def append(self, entry):
+        self.instrument._queries += 1
+        super(_CountingLog, self).append(entry)
+
+class _StageContext(object):
+    __slots__ = ('instrument', 'name', 'start', 'queries')
+
+    def __init__(self, instrument, name):
+        self.instrument = instrument
+        self.name = name
+
+    def __enter__(self):
+        self.instrument._start()
+        self.queries = self.instrument._query_count()
+        self.start = timer()
+
+    def __exit__(self, *exc_info):
+        duration = timer() - self.start
+        queries = self.instrument._query_count() - self.queries
+        self.instrument._stop()
+        self.instrument._record(Stage(self.name, duration, queries))
+
+class _NoStage(object):
+    """ Stand-in for _StageContext when there is no Instrument """
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+no_stage = _NoStage()
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 14:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djanx', '0002_auto_20161228_1108'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TestUniqueRelatedModel',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=20)),
+                ('main_model', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='djanx.TestMainModel')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='testuniquerelatedmodel',
+            unique_together=set([('main_model', 'code')]),
+        ),
+    ]
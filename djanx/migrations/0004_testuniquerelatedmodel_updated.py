@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 16:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djanx', '0003_testuniquerelatedmodel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testuniquerelatedmodel',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+    ]
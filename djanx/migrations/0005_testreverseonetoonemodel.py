@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 15:16
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djanx', '0004_testuniquerelatedmodel_updated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TestReverseOneToOneModel',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('qux', models.TextField()),
+                ('main_model', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='reverse_o2o', to='djanx.TestMainModel')),
+            ],
+        ),
+    ]
@@ -14,3 +14,15 @@ class TestOneToOneModel(models.Model):
 class TestRelatedModel(models.Model):
     baz = models.TextField()
     main_model = models.ForeignKey("TestMainModel")
+
+class TestUniqueRelatedModel(models.Model):
+    code = models.CharField(max_length=20)
+    main_model = models.ForeignKey("TestMainModel")
+    updated = models.DateTimeField(auto_now=True, null=True)
+
+    class Meta:
+        unique_together = (('main_model', 'code'),)
+
+class TestReverseOneToOneModel(models.Model):
+    qux = models.TextField()
+    main_model = models.OneToOneField("TestMainModel", related_name='reverse_o2o')
@@ -0,0 +1,127 @@
+import collections, threading, json, hashlib
+from django.core.exceptions import EmptyResultSet
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.query import QuerySet
+
+class SchemaCache(object):
+    """
+    Bounded LRU cache for the request-independent part of FormGroup schemas.
+
+    Entries are keyed by the form group structure (see make_schema_key).  The
+    cached schema must not contain anything that varies per request, such as
+    formset total_forms / initial_forms; FormGroup fills those in after a hit.
+
+    Note that choices for ModelChoiceFields are captured at the time the schema
+    is built, so call invalidate() when the underlying rows change.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                schema = self._entries.pop(key)
+            except KeyError:
+                return None
+            self._entries[key] = schema # Move to most recently used
+        return copy_schema(schema)
+
+    def set(self, key, schema):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = copy_schema(schema)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, form_class=None):
+        """
+        Drop cached schemas.  If form_class is given, only the entries whose
+        main form, formset form or one-to-one form is form_class (or a subclass,
+        such as the forms made by inlineformset_factory) are dropped.
+        """
+        with self._lock:
+            if form_class is None:
+                self._entries.clear()
+                return
+            for key in list(self._entries.keys()):
+                if any(issubclass(c, form_class) for c in key[3]):
+                    del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+schema_cache = SchemaCache()
+
+def invalidate_schema_cache(form_class=None):
+    """
+    Invalidate the module-level schema cache.  See SchemaCache.invalidate.
+    """
+    schema_cache.invalidate(form_class)
+
+def make_schema_key(form_class, formsets, inline_1to1, field_overrides, using=None):
+    """
+    Returns a hashable key describing everything the cached part of a
+    FormGroup schema depends on.  using is the database alias the choices
+    are read from, if not the default one.
+    """
+    formset_key = tuple(sorted(((fs, fkey) for (fs, fkey) in formsets.items()),
+            key=lambda t: (t[0].__module__, t[0].__name__, t[1])))
+    o2o_key = tuple(sorted((field, _form_class(form))
+            for (field, form) in inline_1to1.items()))
+    overrides_key = tuple(sorted(((fname, attr), _override_key(val))
+            for ((fname, attr), val) in field_overrides.items()))
+    # All the form classes involved, so that invalidate() can find them.
+    form_classes = frozenset([form_class] + [fs.form for (fs, _) in formset_key]
+            + [f for (_, f) in o2o_key])
+    return (form_class, formset_key, o2o_key, form_classes, overrides_key, using)
+
+def copy_schema(schema):
+    """
+    Copies the top-level, formset and one-to-one dicts of schema so that callers
+    can add per-request entries.  Individual field schemas are shared and must
+    be treated as read-only.
+    """
+    result = schema.copy()
+    for (k, v) in list(result.items()):
+        if k == 'formsets':
+            result[k] = collections.OrderedDict((name, fs_schema.copy())
+                    for (name, fs_schema) in v.items())
+        elif isinstance(v, dict) and v.get('type_') == 'one2one':
+            result[k] = v.copy()
+    return result
+
+def schema_hash(schema):
+    """
+    Returns a stable content hash of a schema (without its 'hash_' entry), so
+    that clients which already have the schema can skip downloading it.
+    """
+    schema = dict((k, v) for (k, v) in schema.items() if k != 'hash_')
+    encoded = json.dumps(schema, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+
+def formset_counts(schema):
+    """
+    The per-request formset entries of a schema, which are not covered by
+    schema_hash: reverse lookup -> {'total_forms':..., 'initial_forms':...}
+    """
+    return {name: {'total_forms': fs_schema['total_forms'], 
+                'initial_forms': fs_schema['initial_forms']}
+            for (name, fs_schema) in schema.get('formsets', {}).items()}
+
+def _form_class(form):
+    return form if isinstance(form, type) else form.__class__
+
+def _override_key(val):
+    if isinstance(val, QuerySet):
+        try:
+            return (val.model, str(val.query))
+        except EmptyResultSet:
+            return (val.model, None)
+    try:
+        hash(val)
+    except TypeError:
+        return repr(val)
+    return val
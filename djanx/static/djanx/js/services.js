@@ -1,5 +1,5 @@
 
-angular.module('djanx').factory('djanx', ['$sce', function($sce) {
+angular.module('djanx').factory('djanx', ['$sce', '$http', '$q', function($sce, $http, $q) {
     var djanx = {
         decode: function(serverValues, schema, inplace) {
             /*
@@ -17,6 +17,287 @@ angular.module('djanx').factory('djanx', ['$sce', function($sce) {
             return result;
         },
 
+        validatorCache: {},
+
+        get: function(url, params) {
+            /*
+             * GET a form group, sending the ETag / Last-Modified validators of
+             * the last response for the same url and params.  If the server
+             * answers 304 Not Modified the cached data is used.
+             *
+             * Also sends the hash of the last schema seen for url, so that the
+             * server can leave the schema out if it has not changed; it is then
+             * filled in from the schema cache.  Resolves to the response data.
+             */
+            var key = url + '?' + angular.toJson(params || {});
+            var cached = djanx.validatorCache[key];
+            var headers = {};
+            if(cached) {
+                if(cached.etag)
+                    headers['If-None-Match'] = cached.etag;
+                if(cached.lastModified)
+                    headers['If-Modified-Since'] = cached.lastModified;
+            }
+            var query = angular.extend({}, params);
+            var knownHash = djanx.schemaHashFor(url);
+            if(knownHash && djanx.getSchema(knownHash))
+                query.schema_hash = knownHash;
+
+            return $http.get(url, {params: query, headers: headers}).then(function(response) {
+                var data = response.data;
+                if(data.contents)
+                    djanx.expandFormsets(data.contents);
+                if(data.schema) {
+                    djanx.putSchema(url, data.schema);
+                } else if(data.schema_hash) {
+                    data.schema = djanx.getSchema(data.schema_hash);
+                    if(!data.schema) {
+                        // Lost from the cache in the meantime; ask again in full
+                        djanx.forgetSchema(url);
+                        return djanx.get(url, params);
+                    }
+                    for(var name in data.formset_counts)
+                        angular.extend(data.schema.formsets[name], data.formset_counts[name]);
+                }
+
+                var etag = response.headers('ETag');
+                var lastModified = response.headers('Last-Modified');
+                if(etag || lastModified)
+                    djanx.validatorCache[key] = {etag: etag, lastModified: lastModified,
+                        data: angular.copy(data)};
+                return data;
+            }, function(response) {
+                if(response.status == 304 && cached)
+                    return angular.copy(cached.data);
+                return $q.reject(response);
+            });
+        },
+
+        /*
+         * Schema cache, keyed by the schema's hash_ and kept in localStorage
+         * (or memory if that is unavailable) so it survives page loads.
+         */
+        schemaStore: {},
+
+        _storage: function(method, key, value) {
+            try {
+                if(method == 'get')
+                    return window.localStorage.getItem(key);
+                else if(method == 'set')
+                    window.localStorage.setItem(key, value);
+                else
+                    window.localStorage.removeItem(key);
+            } catch(e) {
+                // Private mode, quota exceeded etc.
+                if(method == 'get')
+                    return djanx.schemaStore[key];
+                else if(method == 'set')
+                    djanx.schemaStore[key] = value;
+                else
+                    delete djanx.schemaStore[key];
+            }
+        },
+
+        schemaHashFor: function(url) {
+            return djanx._storage('get', 'djanx.schemaHash.' + url);
+        },
+
+        getSchema: function(hash) {
+            var json = djanx._storage('get', 'djanx.schema.' + hash);
+            return json ? angular.fromJson(json) : null;
+        },
+
+        putSchema: function(url, schema) {
+            if(!schema.hash_)
+                return;
+            var oldHash = djanx.schemaHashFor(url);
+            if(oldHash && oldHash != schema.hash_)
+                djanx._storage('remove', 'djanx.schema.' + oldHash);
+            djanx._storage('set', 'djanx.schema.' + schema.hash_, angular.toJson(schema));
+            djanx._storage('set', 'djanx.schemaHash.' + url, schema.hash_);
+        },
+
+        forgetSchema: function(url) {
+            djanx._storage('remove', 'djanx.schemaHash.' + url);
+        },
+
+        fetchChoices: function(url, fieldSchema, params) {
+            /*
+             * Fetch a page of choices for a field whose schema has a choices_lazy
+             * descriptor.  url is the form group's URL.  params may contain
+             * search, offset, limit, after and pks (array of selected values).
+             */
+            var query = angular.extend({choices_for: fieldSchema.name}, params);
+            if(fieldSchema.choices_lazy.form)
+                query.choices_form = fieldSchema.choices_lazy.form;
+            if(angular.isArray(query.pks))
+                query.pks = query.pks.join(',');
+            return $http.get(url, {params: query}).then(function(response) {
+                return response.data;
+            });
+        },
+
+        loadMoreChoices: function(url, fieldSchema, search) {
+            /*
+             * Append the next page of choices to fieldSchema.choices.  Changing
+             * the search string starts again from the first page.
+             */
+            var lazy = fieldSchema.choices_lazy;
+            if((search || '') != (lazy.search || '')) {
+                fieldSchema.choices = [];
+                lazy.search = search;
+                lazy.has_more = true;
+                lazy.next_after = null;
+                lazy.offset = 0;
+            }
+            if(!lazy.has_more)
+                return $q.when(fieldSchema.choices);
+
+            var params = {limit: lazy.page_size};
+            if(search)
+                params.search = search;
+            if(lazy.next_after !== null && lazy.next_after !== undefined)
+                params.after = lazy.next_after;
+            else
+                params.offset = lazy.offset;
+
+            return djanx.fetchChoices(url, fieldSchema, params).then(function(page) {
+                fieldSchema.choices = fieldSchema.choices.concat(page.choices);
+                lazy.has_more = page.has_more;
+                lazy.next_after = page.next_after;
+                lazy.offset += page.choices.length;
+                return fieldSchema.choices;
+            });
+        },
+
+        loadMoreRows: function(url, params, contents, name) {
+            /*
+             * Append the next window of rows of a windowed formset (one listed
+             * in contents.formset_windows) to contents.formsets[name].  params
+             * must identify the object, as for get.  Only the rows that are
+             * edited need to be sent back when saving.
+             */
+            var window = contents.formset_windows[name];
+            if(!window.has_more)
+                return $q.when(contents.formsets[name]);
+            var query = angular.extend({window_for: name}, params);
+            if(window.next_after !== null && window.next_after !== undefined)
+                query.after = window.next_after;
+            return $http.get(url, {params: query}).then(function(response) {
+                var page = djanx.expandFormsets({formsets: {rows: response.data.rows}});
+                contents.formsets[name] = contents.formsets[name].concat(page.formsets.rows);
+                window.has_more = response.data.has_more;
+                window.next_after = response.data.next_after;
+                return contents.formsets[name];
+            });
+        },
+
+        expandFormsets: function(contents) {
+            /*
+             * Turn formsets sent in the columnar form ({columns: [...], rows:
+             * [[...], ...]}) into the usual arrays of row objects, in place.
+             */
+            var formsets = contents.formsets || {};
+            for(var name in formsets) {
+                var fs = formsets[name];
+                if(angular.isArray(fs))
+                    continue;
+                var columns = fs.columns;
+                formsets[name] = fs.rows.map(function(values) {
+                    var row = {};
+                    for(var i = 0; i < columns.length; i++)
+                        row[columns[i]] = values[i];
+                    return row;
+                });
+            }
+            return contents;
+        },
+
+        compactFormset: function(rows, fsSchema) {
+            /*
+             * The columnar form of a formset's rows, for submitting.  The form
+             * fields come first, then anything else the rows have (id, DELETE).
+             */
+            var columns = fsSchema.fields.slice();
+            var seen = {};
+            columns.forEach(function(col) { seen[col] = true; });
+            rows.forEach(function(row) {
+                for(var col in row) {
+                    if(!seen[col] && col.charAt(0) != '$') {
+                        seen[col] = true;
+                        columns.push(col);
+                    }
+                }
+            });
+            return {columns: columns, rows: rows.map(function(row) {
+                return columns.map(function(col) {
+                    return row[col] === undefined ? null : row[col];
+                });
+            })};
+        },
+
+        makeDelta: function(original, current) {
+            /*
+             * Build a partial update (for a PATCH to the form group view) from the
+             * contents as loaded and as edited: the changed main and one-to-one
+             * fields, and per formset the added, changed and deleted rows.
+             */
+            var changedFields = function(before, after) {
+                var result = {};
+                for(var field in after) {
+                    if(field == 'formsets' || field.charAt(0) == '$')
+                        continue;
+                    if(angular.isObject(after[field]) && !angular.isDate(after[field])
+                            && !angular.isArray(after[field])) {
+                        // One-to-one sub-form
+                        var sub = changedFields(before[field] || {}, after[field]);
+                        if(Object.keys(sub).length) {
+                            if(after[field].id !== undefined)
+                                sub.id = after[field].id;
+                            result[field] = sub;
+                        }
+                    } else if(!angular.equals(before[field], after[field])) {
+                        result[field] = after[field];
+                    }
+                }
+                return result;
+            };
+
+            var delta = changedFields(original, current);
+            delta.id = current.id;
+            delta.formsets = {};
+            for(var name in current.formsets || {}) {
+                var byId = {};
+                (original.formsets[name] || []).forEach(function(row) { byId[row.id] = row; });
+                var fsDelta = {added: [], changed: [], deleted: []};
+                var seen = {};
+                current.formsets[name].forEach(function(row) {
+                    if(row.id === undefined || row.id === null || row.id === '') {
+                        if(!row.DELETE)
+                            fsDelta.added.push(row);
+                        return;
+                    }
+                    seen[row.id] = true;
+                    if(row.DELETE) {
+                        fsDelta.deleted.push(row.id);
+                        return;
+                    }
+                    var changed = changedFields(byId[row.id] || {}, row);
+                    if(Object.keys(changed).length) {
+                        changed.id = row.id;
+                        fsDelta.changed.push(changed);
+                    }
+                });
+                for(var id in byId) {
+                    if(!seen[id])
+                        fsDelta.deleted.push(byId[id].id);
+                }
+                if(fsDelta.added.length || fsDelta.changed.length || fsDelta.deleted.length)
+                    delta.formsets[name] = fsDelta;
+            }
+            return delta;
+        },
+
         describeErrors: function(formErrors, loc) {
             /*
              * Describe the formErrors that come from the Django backend for a form group
@@ -0,0 +1,48 @@
+from .codec import get_codec
+
+def iter_json(content, schema, order, chunk_size=2000, encoder=None, extra={}):
+    """
+    Encodes the output of FormGroup.serialize_stream as a JSON object with the
+    same 'schema', 'order' and 'contents' entries that BaseFormGroupView.get
+    sends, yielding it in pieces.  The schema and order come first, then the
+    contents with each formset's rows encoded chunk_size at a time as they
+    are read, so the whole payload is never held in memory.
+
+    If schema is None it is left out.  Entries of extra are added after order.
+    Values are encoded with encoder (a JSONEncoder instance) if given, or
+    else with djanx.codec.get_codec().
+    """
+    encode = encoder.encode if encoder else get_codec().dumps
+
+    head = [('schema', schema)] if schema is not None else []
+    head.append(('order', order))
+    head.extend(sorted(extra.items()))
+    yield '{%s, "contents": {' % ', '.join('%s: %s' % (encode(k), encode(v)) for (k, v) in head)
+
+    items = ['%s: %s' % (encode(k), encode(v)) for (k, v) in list(content.items())
+            if k != 'formsets']
+    items.append('"formsets": {')
+    yield ', '.join(items)
+
+    for (i, (reverse_lookup, rows)) in enumerate(content.get('formsets', {}).items()):
+        if isinstance(rows, dict):
+            # Columnar: see FormGroup's columnar argument
+            yield '%s%s: {"columns": %s, "rows": [' % (', ' if i else '', 
+                    encode(reverse_lookup), encode(rows['columns']))
+            rows, close = rows['rows'], ']}'
+        else:
+            yield '%s%s: [' % (', ' if i else '', encode(reverse_lookup))
+            close = ']'
+        buf = []
+        sep = ''
+        for row in rows:
+            buf.append(encode(row))
+            if len(buf) >= chunk_size:
+                yield sep + ', '.join(buf)
+                buf = []
+                sep = ', '
+        if buf:
+            yield sep + ', '.join(buf)
+        yield close
+
+    yield '}}}'
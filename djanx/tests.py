@@ -1,10 +1,24 @@
-from django.test import TestCase
+import json, datetime, decimal, uuid
+from django.test import TestCase, TransactionTestCase
+from django.db import transaction
+from django.core.cache import caches
+from django.utils import timezone
+from django.core.exceptions import ObjectDoesNotExist, ImproperlyConfigured
 from django import forms
 from django.forms import ModelForm, modelform_factory, inlineformset_factory, modelformset_factory, BaseModelFormSet
 
-from .form_group import FormGroup
+from . import form_group
+from .form_group import FormGroup, READ_YOUR_WRITES_CACHE
+from .utils import model_to_dict, get_serializer, plan_related, parse_iso_datetime
+from .schema_cache import (SchemaCache, schema_cache, invalidate_schema_cache,
+        formset_counts)
+from .streaming import iter_json
+from .content_cache import ContentCache
+from .instrumentation import Instrument
+from .codec import JSONCodec, OrjsonCodec, JsonResponse
 from .models import *
 from .forms import *
+from .forms import _existing_unique_values
 
 class MainModelForm(DjanxForm, forms.ModelForm):
     class Meta:
@@ -138,3 +152,921 @@ class FormGroupTestCases(TestCase):
 
         self.assertEqual(main_obj.testrelatedmodel_set.count(), 1) 
         self.assertTrue(all([fso.main_model == main_obj for fso in main_obj.testrelatedmodel_set.all()])) 
+
+class SchemaCacheTestCases(TestCase):
+
+    def testSchemaCache(self):
+        schema_cache.invalidate()
+        o2omodel = TestOneToOneModel.objects.create(bar='I am BAR')
+        mmodel = TestMainModel.objects.create(foo='I am FOO', o2o=o2omodel)
+        rel1 = TestRelatedModel.objects.create(main_model=mmodel, baz='I am BAZ')
+        fs = RelatedModelFormSet
+
+        uncached = FormGroup(MainModelForm, formsets={fs: 'main_model'},
+                inline_1to1={'o2o': OneToOneModelForm()})
+        cached = FormGroup(MainModelForm, formsets={fs: 'main_model'},
+                inline_1to1={'o2o': OneToOneModelForm()}, cache_schema=True)
+
+        _,expected,_ = uncached.serialize(mmodel)
+        _,first,_ = cached.serialize(mmodel)
+        self.assertEqual(len(schema_cache), 1)
+        # Only cached schemas are hashed
+        self.assertEqual(dict((k, v) for (k, v) in first.items() if k != 'hash_'), expected)
+        self.assertNotIn('hash_', expected)
+
+        # Counts are per request, not cached
+        rel2 = TestRelatedModel.objects.create(main_model=mmodel, baz='I also am BAZ')
+        _,second,_ = cached.serialize(mmodel)
+        self.assertEqual(second['formsets']['testrelatedmodel']['initial_forms'], 2)
+        self.assertEqual(len(schema_cache), 1)
+
+        invalidate_schema_cache(RelatedModelForm)
+        self.assertEqual(len(schema_cache), 0)
+
+    def testSchemaCacheEviction(self):
+        cache = SchemaCache(maxsize=2)
+        for i in range(3):
+            cache.set(i, {'order_': []})
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(0))
+        self.assertEqual(cache.get(2), {'order_': []})
+
+    def testGroupPlanEviction(self):
+        # Formset classes made per request each have a plan of their own
+        first = inlineformset_factory(TestMainModel, TestRelatedModel, 
+                form=RelatedModelForm, formset=DjanxInlineFormSet)
+        plan = FormGroup(MainModelForm, formsets={first: 'main_model'}).plan
+        self.assertIs(FormGroup(MainModelForm, formsets={first: 'main_model'}).plan, plan)
+        for i in range(form_group.MAX_PLANS):
+            fs = inlineformset_factory(TestMainModel, TestRelatedModel, 
+                    form=RelatedModelForm, formset=DjanxInlineFormSet)
+            FormGroup(MainModelForm, formsets={fs: 'main_model'})
+        self.assertEqual(len(form_group._plans), form_group.MAX_PLANS)
+        self.assertIsNot(FormGroup(MainModelForm, formsets={first: 'main_model'}).plan, plan)
+
+class LazyChoicesTestCases(TestCase):
+
+    def testLazyChoices(self):
+        class LazyRelatedModelForm(DjanxForm, forms.ModelForm):
+            class Meta:
+                model = TestRelatedModel
+                fields = ('baz', 'main_model')
+                lazy_choices = {'main_model': {'search_fields': ['foo'], 'page_size': 2}}
+
+        mains = [TestMainModel.objects.create(foo='FOO %d' % i) for i in range(3)]
+        schema = LazyRelatedModelForm().get_schema()
+        field_schema = schema['main_model']
+        self.assertEqual(len(field_schema['choices']), 3) # Empty choice plus one page
+        self.assertTrue(field_schema['choices_lazy']['has_more'])
+
+        formfield = LazyRelatedModelForm.base_fields['main_model']
+        page = get_choices_page(formfield, limit=2, 
+                after=field_schema['choices_lazy']['next_after'])
+        self.assertEqual([c['pk'] for c in page['choices']], [mains[2].pk])
+        self.assertFalse(page['has_more'])
+
+        page = get_choices_page(formfield, search='foo 1', search_fields=['foo'])
+        self.assertEqual([c['pk'] for c in page['choices']], [mains[1].pk])
+
+        fg = FormGroup(MainModelForm, formsets={
+            inlineformset_factory(TestMainModel, TestRelatedModel, 
+                form=LazyRelatedModelForm, formset=DjanxInlineFormSet): 'main_model'})
+        _,schema,_ = fg.serialize()
+        fs_field = schema['formsets']['testrelatedmodel']['form']['main_model']
+        self.assertEqual(fs_field['choices_lazy']['form'], 'testrelatedmodel')
+        self.assertEqual(fg.get_lazy_choices_field('main_model', 'testrelatedmodel')[1]['page_size'], 2)
+
+        # Narrowing done in the form's __init__ applies to later pages too
+        class NarrowedForm(LazyRelatedModelForm):
+            def __init__(self, *args, **kwargs):
+                super(NarrowedForm, self).__init__(*args, **kwargs)
+                self.fields['main_model'].queryset = TestMainModel.objects.exclude(
+                        pk=mains[0].pk)
+        NarrowedFormSet = inlineformset_factory(TestMainModel, TestRelatedModel, 
+                form=NarrowedForm, formset=DjanxInlineFormSet)
+        for (fg, form) in [(FormGroup(NarrowedForm), None),
+                (FormGroup(MainModelForm, formsets={NarrowedFormSet: 'main_model'}), 
+                    'testrelatedmodel')]:
+            formfield, options = fg.get_lazy_choices_field('main_model', form)
+            page = get_choices_page(formfield, pks=[m.pk for m in mains])
+            self.assertEqual([c['pk'] for c in page['choices']], [m.pk for m in mains[1:]])
+
+class QueryCountTestCases(TestCase):
+
+    def testSerializeQueryCount(self):
+        fg = FormGroup(MainModelForm, formsets={RelatedModelFormSet: 'main_model'},
+                inline_1to1={'o2o': OneToOneModelForm()})
+
+        for nrows in (2, 20):
+            o2omodel = TestOneToOneModel.objects.create(bar='I am BAR')
+            mmodel = TestMainModel.objects.create(foo='I am FOO', o2o=o2omodel)
+            for i in range(nrows):
+                TestRelatedModel.objects.create(main_model=mmodel, baz='BAZ %d' % i)
+
+            # Main object with its one-to-one, then one query for the formset rows
+            with self.assertNumQueries(2):
+                content,_,_ = fg.serialize(fg.get_object(mmodel.pk))
+            self.assertEqual(len(content['formsets']['testrelatedmodel']), nrows)
+            self.assertEqual(content['o2o']['bar'], 'I am BAR')
+
+    def testModelToDictRecurse(self):
+        o2omodel = TestOneToOneModel.objects.create(bar='I am BAR')
+        mmodel = TestMainModel.objects.create(foo='I am FOO', o2o=o2omodel)
+        recurse = {'o2o': {'fields': ['bar']}}
+        self.assertEqual(plan_related(TestMainModel, recurse=recurse), (['o2o'], []))
+
+        mmodel = TestMainModel.objects.select_related('o2o').get(pk=mmodel.pk)
+        with self.assertNumQueries(0):
+            data = model_to_dict(mmodel, recurse=recurse)
+        self.assertEqual(data['o2o'], {'bar': 'I am BAR'})
+
+    def testDeserializeQueryCount(self):
+        o2omodel = TestOneToOneModel.objects.create(bar='I am BAR')
+        mmodel = TestMainModel.objects.create(foo='I am FOO', o2o=o2omodel)
+        rels = [TestRelatedModel.objects.create(main_model=mmodel, baz='BAZ %d' % i)
+                for i in range(3)]
+
+        class DeclaredGroup(FormGroup):
+            form_class = MainModelForm
+            formsets = {RelatedModelFormSet: 'main_model'}
+            inline_1to1 = {'o2o': OneToOneModelForm}
+        self.assertEqual(DeclaredGroup.plan.formsets, 
+                ((RelatedModelFormSet, 'main_model', 'testrelatedmodel'),))
+
+        in_data = {
+                'o2o': {'bar': 'I am BARRY', 'id': o2omodel.id}, 
+                'foo': 'I am FOORY', 
+                'id': mmodel.id,
+                'formsets': {'testrelatedmodel': 
+                    [{'baz': 'BAZRY %d' % i, 'id': r.id} for (i, r) in enumerate(rels)]},
+            }
+        fg = DeclaredGroup()
+        # The main object with its one-to-one object, then the formset rows
+        with self.assertNumQueries(2):
+            fg.deserialize(in_data)
+            fs = list(fg.bound_formsets.values())[0]
+            self.assertEqual(fs.initial_form_count(), 3)
+            self.assertEqual([f.instance for f in fs.forms], rels)
+        self.assertEqual(fg.o2o_forms['o2o'].instance, o2omodel)
+        self.assertTrue(fg.is_valid())
+        main_obj = fg.save(commit=True)
+        self.assertEqual(sorted(r.baz for r in main_obj.testrelatedmodel_set.all()), 
+                ['BAZRY 0', 'BAZRY 1', 'BAZRY 2'])
+
+class BulkSaveTestCases(TestCase):
+
+    def testBulkSave(self):
+        o2omodel = TestOneToOneModel.objects.create(bar='I am BAR')
+        mmodel = TestMainModel.objects.create(foo='I am FOO', o2o=o2omodel)
+        rels = [TestRelatedModel.objects.create(main_model=mmodel, baz='BAZ %d' % i) 
+                for i in range(4)]
+
+        in_data = {
+                'o2o': {'bar': 'I am BAR', 'id': o2omodel.id}, 
+                'foo': 'I am FOO', 
+                'id': mmodel.id,
+                'formsets': {
+                    'testrelatedmodel': 
+                        [{'baz': 'BAZ 0', 'id': rels[0].id},
+                         {'baz': 'BAZRY 1', 'id': rels[1].id},
+                         {'baz': 'BAZRY 2', 'id': rels[2].id},
+                         {'baz': 'BAZ 3', 'id': rels[3].id, 'DELETE': True}] +
+                        [{'baz': 'NEW %d' % i} for i in range(20)]
+                    }
+            }
+        fg = FormGroup(MainModelForm, formsets={RelatedModelFormSet: 'main_model'},
+                inline_1to1={'o2o': OneToOneModelForm}, bulk_save=True)
+        fg.deserialize(in_data)
+        self.assertTrue(fg.is_valid())
+
+        # Main form, one-to-one and main object again, then one statement each
+        # for the new, changed and deleted rows
+        with self.assertNumQueries(6):
+            main_obj = fg.save(commit=True)
+
+        self.assertEqual(len(fg.changed_fs_objects['testrelatedmodel']), 2)
+        bazzes = set(main_obj.testrelatedmodel_set.values_list('baz', flat=True))
+        self.assertEqual(bazzes, set(['BAZ 0', 'BAZRY 1', 'BAZRY 2'] + 
+            ['NEW %d' % i for i in range(20)]))
+
+    def testBulkSaveAutoNow(self):
+        mmodel = TestMainModel.objects.create(foo='I am FOO')
+        row = TestUniqueRelatedModel.objects.create(main_model=mmodel, code='A')
+        old = timezone.now() - datetime.timedelta(days=1)
+        TestUniqueRelatedModel.objects.filter(pk=row.pk).update(updated=old)
+        UniqueFormSet = inlineformset_factory(TestMainModel, TestUniqueRelatedModel,
+                fields=('code',), formset=DjanxInlineFormSet)
+        fg = FormGroup(MainModelForm, formsets={UniqueFormSet: 'main_model'}, bulk_save=True)
+        fg.deserialize({'id': mmodel.pk, 'foo': 'I am FOO', 
+            'formsets': {'testuniquerelatedmodel': [{'id': row.pk, 'code': 'B'}]}})
+        self.assertTrue(fg.is_valid())
+        fg.save(commit=True)
+
+        # The changed row's timestamp moves on, as with save()
+        row.refresh_from_db()
+        self.assertEqual(row.code, 'B')
+        self.assertGreater(row.updated, old)
+
+class SerializerTestCases(TestCase):
+
+    def testSerializer(self):
+        o2omodel = TestOneToOneModel.objects.create(bar='I am BAR')
+        mmodel = TestMainModel.objects.create(foo='I am FOO', o2o=o2omodel)
+        for i in range(3):
+            TestRelatedModel.objects.create(main_model=mmodel, baz='BAZ %d' % i)
+
+        serializer = get_serializer(TestRelatedModel, exclude=['main_model'])
+        self.assertIs(serializer, get_serializer(TestRelatedModel, exclude=('main_model',)))
+
+        qs = TestRelatedModel.objects.order_by('pk')
+        expected = [model_to_dict(m, exclude=['main_model']) for m in qs]
+        self.assertEqual(serializer.many(list(qs)), expected)
+        self.assertEqual(serializer.many(qs), expected)
+        self.assertEqual(serializer.many(qs.values('id', 'baz')), expected)
+        self.assertEqual(expected[0], {'id': expected[0]['id'], 'baz': 'BAZ 0'})
+
+    def testSerializeMany(self):
+        fg = FormGroup(MainModelForm, formsets={RelatedModelFormSet: 'main_model'},
+                inline_1to1={'o2o': OneToOneModelForm()})
+        for i in range(5):
+            o2omodel = TestOneToOneModel.objects.create(bar='BAR %d' % i)
+            mmodel = TestMainModel.objects.create(foo='FOO %d' % i, o2o=o2omodel)
+            for j in range(i):
+                TestRelatedModel.objects.create(main_model=mmodel, baz='BAZ %d' % j)
+
+        qs = TestMainModel.objects.order_by('pk')
+        expected = [fg.serialize(m)[0] for m in qs]
+        _, expected_schema, expected_order = fg.serialize()
+
+        schema, order, contents = fg.serialize_many(qs, chunk_size=2)
+        self.assertEqual(schema, expected_schema)
+        self.assertEqual(order, expected_order)
+        # One streamed query for the main objects (with their one-to-ones), and
+        # one query per chunk of two for the formset rows
+        with self.assertNumQueries(4):
+            self.assertEqual(list(contents), expected)
+
+    def testSerializeStream(self):
+        o2omodel = TestOneToOneModel.objects.create(bar='I am BAR')
+        mmodel = TestMainModel.objects.create(foo='I am FOO', o2o=o2omodel)
+        for i in range(5):
+            TestRelatedModel.objects.create(main_model=mmodel, baz='BAZ %d' % i)
+        fg = FormGroup(MainModelForm, formsets={RelatedModelFormSet: 'main_model'},
+                inline_1to1={'o2o': OneToOneModelForm()})
+
+        content, schema, order = fg.serialize(mmodel)
+        expected = json.loads(json.dumps({'contents': content, 'schema': schema, 'order': order}))
+
+        content, schema, order = fg.serialize_stream(mmodel, chunk_size=2)
+        pieces = list(iter_json(content, schema, order, chunk_size=2))
+        self.assertEqual(json.loads(''.join(pieces)), expected)
+
+class ConditionalGetTestCases(TestCase):
+
+    def testValidator(self):
+        o2omodel = TestOneToOneModel.objects.create(bar='I am BAR')
+        mmodel = TestMainModel.objects.create(foo='I am FOO', o2o=o2omodel)
+        TestRelatedModel.objects.create(main_model=mmodel, baz='I am BAZ')
+        fg = FormGroup(MainModelForm, formsets={RelatedModelFormSet: 'main_model'},
+                inline_1to1={'o2o': OneToOneModelForm()})
+
+        self.assertIsNone(fg.get_validator(mmodel, 'updated'))
+
+        # The test models have no timestamp or version, but the mechanics are
+        # the same with an integer field.
+        obj = fg.get_object(mmodel.pk)
+        with self.assertNumQueries(1):
+            etag, last_modified = fg.get_validator(obj, 'id')
+        self.assertIsNone(last_modified)
+        self.assertEqual(fg.get_validator(obj, 'id'), (etag, None))
+
+        TestRelatedModel.objects.create(main_model=mmodel, baz='I also am BAZ')
+        self.assertNotEqual(fg.get_validator(obj, 'id')[0], etag)
+
+        # Rows whose versions add up to the same sum are told apart
+        for pk in (100, 103):
+            TestRelatedModel.objects.create(pk=pk, main_model=mmodel, baz='BAZ')
+        etag = fg.get_validator(obj, 'id')[0]
+        TestRelatedModel.objects.filter(pk__in=[100, 103]).delete()
+        for pk in (101, 102):
+            TestRelatedModel.objects.create(pk=pk, main_model=mmodel, baz='BAZ')
+        self.assertNotEqual(fg.get_validator(obj, 'id')[0], etag)
+
+        # With cache_schema, schema changes such as new choices count too
+        class ChoiceForm(DjanxForm, forms.ModelForm):
+            class Meta:
+                model = TestMainModel
+                fields = ['foo', 'o2o']
+        self.addCleanup(invalidate_schema_cache)
+        fg = FormGroup(ChoiceForm, cache_schema=True)
+        etag = fg.get_validator(obj, 'id')[0]
+        self.assertEqual(fg.get_validator(obj, 'id')[0], etag)
+        TestOneToOneModel.objects.create(bar='NEW CHOICE')
+        invalidate_schema_cache(ChoiceForm)
+        self.assertNotEqual(fg.get_validator(obj, 'id')[0], etag)
+
+    def testSchemaHash(self):
+        fg = FormGroup(MainModelForm, formsets={RelatedModelFormSet: 'main_model'},
+                inline_1to1={'o2o': OneToOneModelForm()}, cache_schema=True)
+        mmodel1 = TestMainModel.objects.create(foo='I am FOO')
+        mmodel2 = TestMainModel.objects.create(foo='I am FOO too')
+        TestRelatedModel.objects.create(main_model=mmodel2, baz='I am BAZ')
+
+        _,schema1,_ = fg.serialize(mmodel1)
+        _,schema2,_ = fg.serialize(mmodel2)
+        self.assertEqual(schema1['hash_'], schema2['hash_'])
+        self.assertEqual(formset_counts(schema2)['testrelatedmodel']['initial_forms'], 1)
+
+        other = FormGroup(MainModelForm, cache_schema=True)
+        self.assertNotEqual(other.serialize()[1]['hash_'], schema1['hash_'])
+
+        # Schemas that are not cached are not hashed
+        self.assertNotIn('hash_', FormGroup(MainModelForm).serialize()[1])
+
+class DeltaTestCases(TestCase):
+
+    def testUnserializeDelta(self):
+        o2omodel = TestOneToOneModel.objects.create(bar='I am BAR')
+        mmodel = TestMainModel.objects.create(foo='I am FOO', o2o=o2omodel)
+        rels = [TestRelatedModel.objects.create(main_model=mmodel, baz='BAZ %d' % i) 
+                for i in range(10)]
+
+        in_data = {
+                'id': mmodel.id,
+                'o2o': {'bar': 'I am BARRY', 'id': o2omodel.id}, 
+                'formsets': {
+                    'testrelatedmodel': {
+                        'added': [{'baz': 'NEW'}],
+                        'changed': [{'baz': 'BAZRY 1', 'id': rels[1].id}],
+                        'deleted': [rels[2].id],
+                        }
+                    }
+            }
+        fg = FormGroup(MainModelForm, formsets={RelatedModelFormSet: 'main_model'},
+                inline_1to1={'o2o': OneToOneModelForm})
+        fg.deserialize_delta(in_data)
+        self.assertTrue(fg.is_valid())
+        # Only the touched rows are bound
+        self.assertEqual(len(fg.bound_formsets['testrelatedmodel', 'main_model'].forms), 3)
+        main_obj = fg.save(commit=True)
+
+        self.assertEqual(main_obj.foo, 'I am FOO')
+        self.assertEqual(main_obj.o2o.bar, 'I am BARRY')
+        bazzes = set(main_obj.testrelatedmodel_set.values_list('baz', flat=True))
+        self.assertEqual(bazzes, set(['BAZ 0', 'BAZRY 1', 'NEW'] + 
+            ['BAZ %d' % i for i in range(3, 10)]))
+
+        # Rows of other objects are rejected
+        other = TestMainModel.objects.create(foo='Other')
+        other_rel = TestRelatedModel.objects.create(main_model=other, baz='Not yours')
+        with self.assertRaises(ObjectDoesNotExist):
+            fg.deserialize_delta({'id': mmodel.id, 'formsets': {'testrelatedmodel': 
+                {'changed': [{'id': other_rel.id, 'baz': 'Mine now'}]}}})
+
+        # Ids sent as strings match the rows' pks
+        fg.deserialize_delta({'id': mmodel.id, 'formsets': {'testrelatedmodel': {
+                'changed': [{'baz': 'BAZRY 3', 'id': str(rels[3].id)}],
+                'deleted': [str(rels[4].id)]}}})
+        self.assertTrue(fg.is_valid())
+        fg.save()
+        bazzes = set(main_obj.testrelatedmodel_set.values_list('baz', flat=True))
+        self.assertIn('BAZRY 3', bazzes)
+        self.assertNotIn('BAZ 4', bazzes)
+
+        # A missing main or row id is an error, not a new object
+        with self.assertRaises(ObjectDoesNotExist):
+            fg.deserialize_delta({'foo': 'No id'})
+        with self.assertRaises(ObjectDoesNotExist):
+            fg.deserialize_delta({'id': mmodel.id, 'formsets': {'testrelatedmodel': 
+                {'changed': [{'baz': 'No id'}]}}})
+
+class FormSetValidationTestCases(TestCase):
+
+    def testPrefetchChoices(self):
+        mains = [TestMainModel.objects.create(foo='FOO %d' % i) for i in range(3)]
+        ChoiceFormSet = modelformset_factory(TestRelatedModel, fields=('baz', 'main_model'),
+                formset=DjanxModelFormSet)
+
+        rows = [{'baz': 'BAZ %d' % i, 'main_model': mains[i % 3].pk} for i in range(20)]
+        fs = ChoiceFormSet.from_json(rows, queryset=TestRelatedModel.objects.none())
+        # One query for the choices, one for the model's ForeignKey check
+        with self.assertNumQueries(2):
+            self.assertTrue(fs.is_valid())
+        self.assertEqual([f.cleaned_data['main_model'] for f in fs.forms[:3]], mains)
+
+        rows[1]['main_model'] = 9999
+        rows[2]['main_model'] = 'not a pk'
+        fs = ChoiceFormSet.from_json(rows, queryset=TestRelatedModel.objects.none())
+        self.assertFalse(fs.is_valid())
+        self.assertEqual([bool(e) for e in fs.errors[:4]], [False, True, True, False])
+        self.assertEqual(fs.forms[1].errors['main_model'][0], 
+                ChoiceFormSet.form.base_fields['main_model'].error_messages['invalid_choice'])
+
+        # Narrowing done in the form's __init__ applies to the prefetched rows
+        class NarrowedForm(forms.ModelForm):
+            class Meta:
+                model = TestRelatedModel
+                fields = ('baz', 'main_model')
+            def __init__(self, *args, **kwargs):
+                super(NarrowedForm, self).__init__(*args, **kwargs)
+                self.fields['main_model'].queryset = TestMainModel.objects.exclude(
+                        pk=mains[0].pk)
+        NarrowedFormSet = modelformset_factory(TestRelatedModel, form=NarrowedForm,
+                formset=DjanxModelFormSet)
+        rows = [{'baz': 'BAZ %d' % i, 'main_model': mains[i % 3].pk} for i in range(20)]
+        fs = NarrowedFormSet.from_json(rows, queryset=TestRelatedModel.objects.none())
+        with self.assertNumQueries(2):
+            self.assertFalse(fs.is_valid())
+        self.assertEqual([bool(e) for e in fs.errors[:3]], [True, False, False])
+
+    def testBatchedUniqueChecks(self):
+        main = TestMainModel.objects.create(foo='FOO')
+        other = TestMainModel.objects.create(foo='OTHER')
+        TestUniqueRelatedModel.objects.create(main_model=main, code='TAKEN')
+        TestUniqueRelatedModel.objects.create(main_model=other, code='FREE')
+        UniqueFormSet = inlineformset_factory(TestMainModel, TestUniqueRelatedModel,
+                fields=('code',), formset=DjanxInlineFormSet)
+
+        rows = [{'code': 'CODE %d' % i} for i in range(20)]
+        rows[5]['code'] = 'TAKEN'
+        rows[6]['code'] = 'FREE'
+        fs = UniqueFormSet.from_json(rows, instance=main, 
+                queryset=TestUniqueRelatedModel.objects.none())
+        # One query for the unique_together check of all rows
+        with self.assertNumQueries(1):
+            self.assertFalse(fs.is_valid())
+        self.assertEqual([i for (i, e) in enumerate(fs.errors) if e], [5])
+        self.assertIn('__all__', fs.errors[5])
+
+        # Duplicates between the submitted rows are still caught
+        rows[5]['code'] = 'CODE 4'
+        fs = UniqueFormSet.from_json(rows, instance=main, 
+                queryset=TestUniqueRelatedModel.objects.none())
+        self.assertFalse(fs.is_valid())
+        self.assertTrue(fs.non_form_errors())
+
+        # Rows the database matches but Python does not (here the key as a
+        # string) are looked up again one by one
+        taken = TestUniqueRelatedModel.objects.get(code='TAKEN')
+        existing = _existing_unique_values(TestUniqueRelatedModel, ('main_model', 'code'),
+                [(str(main.pk), 'TAKEN'), (str(main.pk), 'CODE 1')])
+        self.assertEqual(existing[(str(main.pk), 'TAKEN')], set([taken.pk]))
+        self.assertFalse(existing[(str(main.pk), 'CODE 1')])
+
+        # Batches take as many rows as the database allows query parameters
+        # (999 on SQLite, two per row here)
+        rows = [(main.pk, 'CODE %d' % i) for i in range(1000)]
+        with self.assertNumQueries(3):
+            _existing_unique_values(TestUniqueRelatedModel, ('main_model', 'code'), rows)
+
+class ValidationStateTestCases(TestCase):
+
+    def testValidationState(self):
+        in_data = {
+                'o2o': {'bar': ''}, 
+                'foo': '', 
+                'formsets': {'testrelatedmodel': [{'baz': 'I am BAZ'}]},
+            }
+        fg = FormGroup(MainModelForm, formsets={RelatedModelFormSet: 'main_model'},
+                inline_1to1={'o2o': OneToOneModelForm})
+        fg.deserialize(in_data)
+
+        # Stops at the invalid main form
+        self.assertFalse(fg.is_valid())
+        self.assertIsNone(fg.o2o_forms['o2o']._errors)
+        self.assertEqual(fg.validation_state, 'invalid')
+
+        errors = fg.errors
+        self.assertIn('foo', errors)
+        self.assertIn('bar', errors['o2o'])
+        self.assertEqual(errors['testrelatedmodel'], [{}])
+        self.assertIs(fg.errors, errors)
+
+        in_data.update({'foo': 'I am FOO', 'o2o': {'bar': 'I am BAR'}})
+        fg.deserialize(in_data)
+        self.assertEqual(fg.validation_state, 'bound')
+        self.assertTrue(fg.is_valid())
+        with self.assertNumQueries(0):
+            self.assertTrue(fg.is_valid())
+        main_obj = fg.save(commit=True)
+
+        # A bind that fails leaves the group unbound, not valid
+        with self.assertRaises(ObjectDoesNotExist):
+            fg.deserialize_delta({'id': main_obj.pk, 'formsets': {'testrelatedmodel': 
+                {'deleted': [0]}}})
+        self.assertEqual(fg.validation_state, 'unbound')
+        with self.assertRaises(ValueError):
+            fg.is_valid()
+        with self.assertRaises(ValueError):
+            fg.save()
+
+class StaticFieldsTestCases(TestCase):
+
+    def testStaticFields(self):
+        class StaticForm(DjanxForm, forms.ModelForm):
+            class Meta:
+                model = TestMainModel
+                fields = ['foo']
+                static = {'bar_text': {'field': 'o2o__bar', 'label': 'Bar'}}
+
+        mains = [TestMainModel.objects.create(foo='FOO %d' % i, 
+                    o2o=TestOneToOneModel.objects.create(bar='BAR %d' % i))
+                for i in range(3)]
+        fg = FormGroup(StaticForm)
+
+        obj = fg.get_object(mains[0].pk)
+        with self.assertNumQueries(0):
+            content, schema, order = fg.serialize(obj)
+        self.assertEqual(content['bar_text'], 'BAR 0')
+        self.assertTrue(schema['bar_text']['disabled'])
+
+        # Objects that were not loaded through the group still work
+        self.assertEqual(StaticForm(instance=mains[1]).get_static(mains[1]), 
+                {'bar_text': 'BAR 1'})
+
+        _, _, contents = fg.serialize_many(TestMainModel.objects.order_by('pk'))
+        with self.assertNumQueries(1):
+            self.assertEqual([c['bar_text'] for c in contents], ['BAR 0', 'BAR 1', 'BAR 2'])
+
+        # Objects loaded elsewhere are serialized without statics, or queries
+        with self.assertNumQueries(0):
+            content, schema, order = fg.serialize(mains[1])
+        self.assertNotIn('bar_text', content)
+
+        class ClashingForm(StaticForm):
+            class Meta(StaticForm.Meta):
+                static = {'foo': {'field': 'o2o__bar'}}
+        with self.assertRaises(ImproperlyConfigured):
+            FormGroup(ClashingForm).get_object(mains[0].pk)
+        with self.assertRaises(ImproperlyConfigured):
+            ClashingForm().get_schema()
+
+class CodecTestCases(TestCase):
+
+    def testParseIsoDatetime(self):
+        from django.utils.timezone import utc
+        self.assertEqual(parse_iso_datetime('2017-03-01'), datetime.datetime(2017, 3, 1))
+        self.assertEqual(parse_iso_datetime('2017-03-01T12:30:00.250Z'),
+                datetime.datetime(2017, 3, 1, 12, 30, 0, 250000, tzinfo=utc))
+        self.assertEqual(parse_iso_datetime('2017-03-01T14:30:00+02:00'),
+                datetime.datetime(2017, 3, 1, 12, 30, tzinfo=utc))
+        # Other shapes still go through dateutil
+        self.assertEqual(parse_iso_datetime('March 1, 2017'), datetime.datetime(2017, 3, 1))
+        with self.assertRaises(ValueError):
+            parse_iso_datetime('not a date')
+
+        field = DateField()
+        self.assertEqual(field.clean('2017-03-01T23:00:00.000Z'), datetime.date(2017, 3, 1))
+
+    def testCodec(self):
+        from django.utils.timezone import utc
+        from django.utils.translation import ugettext_lazy
+        value = {
+                'datetime': datetime.datetime(2017, 3, 1, 12, 30, 0, 123456, tzinfo=utc),
+                'naive': datetime.datetime(2017, 3, 1, 12, 30),
+                'date': datetime.date(2017, 3, 1),
+                'time': datetime.time(12, 30, 0, 250000),
+                'decimal': decimal.Decimal('1.10'),
+                'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+                'lazy': ugettext_lazy('Foo'),
+                'nested': [{1: 'one'}, (2, 3)],
+                'big': 2**70,
+            }
+        expected = JSONCodec().dumps(value)
+        self.assertIn('"2017-03-01T12:30:00.123Z"', expected)
+        try:
+            codec = OrjsonCodec()
+        except ImportError:
+            codec = JSONCodec()
+        self.assertEqual(json.loads(codec.dumps(value)), json.loads(expected))
+        self.assertEqual(codec.loads(b'{"a": [1, "b"]}'), {'a': [1, 'b']})
+
+        response = JsonResponse({'date': datetime.date(2017, 3, 1)})
+        self.assertEqual(json.loads(response.content.decode('utf-8')), {'date': '2017-03-01'})
+        with self.assertRaises(TypeError):
+            JsonResponse([1])
+
+class FormSetEncodingTestCases(TestCase):
+
+    def testColumnarFormsets(self):
+        mmodel = TestMainModel.objects.create(foo='I am FOO')
+        rels = [TestRelatedModel.objects.create(main_model=mmodel, baz='BAZ %d' % i)
+                for i in range(3)]
+        fg = FormGroup(MainModelForm, formsets={RelatedModelFormSet: 'main_model'},
+                columnar=True)
+
+        content, schema, order = fg.serialize(mmodel)
+        formset = content['formsets']['testrelatedmodel']
+        self.assertEqual(formset['columns'], ['baz', 'id', 'main_model'])
+        self.assertEqual(formset['rows'], [['BAZ %d' % i, r.pk, mmodel.pk] 
+            for (i, r) in enumerate(rels)])
+
+        stream_content, schema, order = fg.serialize_stream(mmodel, chunk_size=2)
+        streamed = json.loads(''.join(iter_json(stream_content, schema, order, chunk_size=2)))
+        self.assertEqual(streamed['contents']['formsets']['testrelatedmodel'], 
+                json.loads(json.dumps(formset)))
+
+        _, _, contents = fg.serialize_many(TestMainModel.objects.filter(pk=mmodel.pk))
+        self.assertEqual(list(contents)[0]['formsets']['testrelatedmodel'], formset)
+
+        # The same form is accepted on submit
+        formset['rows'][1][0] = 'BAZRY'
+        fg.deserialize({'id': mmodel.pk, 'foo': 'I am FOO', 'formsets': content['formsets']})
+        self.assertTrue(fg.is_valid())
+        fg.save()
+        self.assertEqual(TestRelatedModel.objects.get(pk=rels[1].pk).baz, 'BAZRY')
+
+    def testWindowedFormsets(self):
+        mmodel = TestMainModel.objects.create(foo='I am FOO')
+        rels = [TestRelatedModel.objects.create(main_model=mmodel, baz='BAZ %d' % i)
+                for i in range(5)]
+        WindowedFormSet = inlineformset_factory(TestMainModel, TestRelatedModel, 
+                form=RelatedModelForm, can_delete=True, 
+                formset=type('WindowedFormSet', (DjanxInlineFormSet,), {'window_size': 2}))
+        fg = FormGroup(MainModelForm, formsets={WindowedFormSet: 'main_model'})
+
+        content, schema, order = fg.serialize(mmodel)
+        self.assertEqual([r['id'] for r in content['formsets']['testrelatedmodel']],
+                [r.pk for r in rels[:2]])
+        self.assertEqual(content['formset_windows']['testrelatedmodel'], 
+                {'total': 5, 'window_size': 2, 'has_more': True, 'next_after': rels[1].pk})
+        self.assertEqual(schema['formsets']['testrelatedmodel']['initial_forms'], 2)
+
+        window = fg.get_window(mmodel.pk, 'testrelatedmodel', after=rels[1].pk)
+        self.assertEqual([r['id'] for r in window['rows']], [r.pk for r in rels[2:4]])
+        window = fg.get_window(mmodel.pk, 'testrelatedmodel', after=window['next_after'])
+        self.assertEqual(([r['id'] for r in window['rows']], window['has_more']), 
+                ([rels[4].pk], False))
+
+        # Only the rows sent are saved; the others are not deleted
+        fg.deserialize({'id': mmodel.pk, 'foo': 'I am FOO', 'formsets': {'testrelatedmodel': [
+                {'baz': 'NEW'}, 
+                {'id': rels[3].pk, 'baz': 'BAZRY'}, 
+                {'id': rels[0].pk, 'baz': 'BAZ 0', 'DELETE': True}]}})
+        self.assertTrue(fg.is_valid())
+        fg.save()
+        self.assertEqual(sorted(mmodel.testrelatedmodel_set.values_list('baz', flat=True)),
+                ['BAZ 1', 'BAZ 2', 'BAZ 4', 'BAZRY', 'NEW'])
+
+        other = TestMainModel.objects.create(foo='OTHER')
+        with self.assertRaises(ObjectDoesNotExist):
+            fg.deserialize({'id': other.pk, 'foo': 'OTHER', 'formsets': {'testrelatedmodel': [
+                {'id': rels[1].pk, 'baz': 'STOLEN'}]}})
+
+        # serialize_many gives each object its first window, as serialize does
+        for i in range(3):
+            TestRelatedModel.objects.create(main_model=other, baz='OTHER %d' % i)
+        empty = TestMainModel.objects.create(foo='EMPTY')
+        qs = TestMainModel.objects.order_by('pk')
+        expected = [fg.serialize(m)[0] for m in qs]
+        _, _, contents = fg.serialize_many(qs)
+        with self.assertNumQueries(3):
+            self.assertEqual(list(contents), expected)
+        self.assertEqual(expected[2]['formset_windows']['testrelatedmodel'], 
+                {'total': 0, 'window_size': 2, 'has_more': False, 'next_after': None})
+
+class FieldSchemaTestCases(TestCase):
+
+    def testFieldSchema(self):
+        expected = {'class': 'CharField', 'help_text': '', 
+            'disabled': False, 'label': 'Foo', 'label_suffix': None, 'initial': None, 
+            'required': True, 'max_length': None, 'type_': 'field'}
+        self.assertEqual(get_formfield_schema(MainModelForm.base_fields['foo']), expected)
+        expected.update({'name': 'foo', 'hidden': False})
+        schema = MainModelForm().get_schema()
+        self.assertEqual(schema['foo'], expected)
+        self.assertEqual(json.loads(json.dumps(schema))['foo'], expected)
+
+        # Only the attributes the field class has are described
+        int_schema = get_formfield_schema(forms.IntegerField(max_value=5))
+        self.assertEqual((int_schema['max_value'], 'max_length' in int_schema), (5, False))
+
+class ContentCacheTestCases(TestCase):
+
+    def testContentCache(self):
+        o2omodel = TestOneToOneModel.objects.create(bar='I am BAR')
+        mmodel = TestMainModel.objects.create(foo='I am FOO', o2o=o2omodel)
+        rel = TestRelatedModel.objects.create(main_model=mmodel, baz='I am BAZ')
+        content_cache = ContentCache(key_prefix='djanx.test.%s' % id(self))
+        self.addCleanup(content_cache.disconnect)
+        fg = FormGroup(MainModelForm, formsets={RelatedModelFormSet: 'main_model'},
+                inline_1to1={'o2o': OneToOneModelForm()}, cache_schema=True, 
+                content_cache=content_cache)
+
+        expected = fg.serialize(mmodel)
+        with self.assertNumQueries(0):
+            self.assertEqual(fg.serialize(mmodel), expected)
+        self.assertEqual(content_cache.stats(), {'misses': 1, 'computes': 1, 'hits': 1})
+
+        # Saving any model of the group invalidates the object's content
+        for (obj, attr, value) in [(rel, 'baz', 'BAZRY'), (o2omodel, 'bar', 'BARRY'), 
+                (mmodel, 'foo', 'FOORY')]:
+            setattr(obj, attr, value)
+            obj.save()
+            content, schema, order = fg.serialize(mmodel)
+            self.assertEqual(content['formsets']['testrelatedmodel'][0]['baz'], 'BAZRY')
+        self.assertEqual((content['o2o']['bar'], content['foo']), ('BARRY', 'FOORY'))
+        TestRelatedModel.objects.create(main_model=mmodel, baz='NEW')
+        content, schema, order = fg.serialize(mmodel)
+        self.assertEqual(len(content['formsets']['testrelatedmodel']), 2)
+        self.assertEqual(schema['formsets']['testrelatedmodel']['initial_forms'], 2)
+
+        # Versions are not reused once evicted, so older entries stay orphaned
+        content_cache.cache.delete(content_cache._version_key(fg.plan.content_cache_key, 
+                mmodel.pk))
+        TestRelatedModel.objects.filter(main_model=mmodel).update(baz='UPDATED')
+        content, schema, order = fg.serialize(mmodel)
+        self.assertEqual(content['formsets']['testrelatedmodel'][0]['baz'], 'UPDATED')
+
+        # Reverse one-to-ones invalidate the objects they point to
+        class ReverseForm(DjanxForm, forms.ModelForm):
+            class Meta:
+                model = TestReverseOneToOneModel
+                fields = ('qux',)
+        reverse = TestReverseOneToOneModel.objects.create(main_model=mmodel, qux='QUX')
+        reverse_group = FormGroup(MainModelForm, inline_1to1={'reverse_o2o': ReverseForm()},
+                content_cache=content_cache)
+        self.assertEqual(reverse_group.serialize(mmodel)[0]['reverse_o2o']['qux'], 'QUX')
+        reverse.qux = 'QUUX'
+        reverse.save()
+        self.assertEqual(reverse_group.serialize(mmodel)[0]['reverse_o2o']['qux'], 'QUUX')
+
+        # Columnar groups on the same forms get their own entries
+        columnar = FormGroup(MainModelForm, formsets={RelatedModelFormSet: 'main_model'},
+                inline_1to1={'o2o': OneToOneModelForm()}, content_cache=content_cache,
+                columnar=True)
+        content, schema, order = columnar.serialize(mmodel)
+        self.assertEqual(content['formsets']['testrelatedmodel']['columns'][0], 'baz')
+
+        content_cache.disconnect()
+        invalidations = content_cache.stats()['invalidations']
+        rel.save()
+        self.assertEqual(content_cache.stats()['invalidations'], invalidations)
+
+    def testContentCacheStampede(self):
+        import threading, time
+        content_cache = ContentCache(key_prefix='djanx.test.%s' % id(self), poll_interval=0.01)
+        self.addCleanup(content_cache.disconnect)
+        fg = FormGroup(MainModelForm)
+        calls = []
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return {'foo': 'FOO'}, ['foo']
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+                content_cache.get_or_compute(fg, 1, compute))) for i in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [({'foo': 'FOO'}, ['foo'])] * 5)
+
+class InstrumentationTestCases(TestCase):
+
+    def testInstrumentation(self):
+        o2omodel = TestOneToOneModel.objects.create(bar='I am BAR')
+        mmodel = TestMainModel.objects.create(foo='I am FOO', o2o=o2omodel)
+        rels = [TestRelatedModel.objects.create(main_model=mmodel, baz='BAZ %d' % i)
+                for i in range(3)]
+        ended = []
+        instrument = Instrument(callback=ended.append)
+        fg = FormGroup(MainModelForm, formsets={RelatedModelFormSet: 'main_model'},
+                inline_1to1={'o2o': OneToOneModelForm}, instrument=instrument)
+
+        fg.deserialize({
+                'o2o': {'bar': 'I am BARRY', 'id': o2omodel.id}, 
+                'foo': 'I am FOORY', 
+                'id': mmodel.id,
+                'formsets': {'testrelatedmodel': 
+                    [{'baz': 'BAZRY %d' % i, 'id': r.id} for (i, r) in enumerate(rels)]},
+            })
+        self.assertTrue(fg.is_valid())
+        fg.save(commit=True)
+
+        stages = dict((s.name, s) for s in instrument.stages)
+        self.assertEqual([s.name for s in instrument.stages if '.' not in s.name], 
+                ['deserialize', 'is_valid', 'save'])
+        self.assertEqual(ended, instrument.stages)
+        self.assertEqual(stages['deserialize.load'].queries, 1)
+        self.assertEqual(stages['deserialize.formset.testrelatedmodel'].queries, 1)
+        self.assertEqual(stages['deserialize'].queries, 2)
+        self.assertIn('is_valid.o2o.o2o', stages)
+        self.assertIn('save.formset.testrelatedmodel', stages)
+        self.assertEqual(len(stages), len(instrument.stages))
+        total = instrument.total()
+        self.assertEqual(total.queries, sum(stages[name].queries 
+            for name in ['deserialize', 'is_valid', 'save']))
+        self.assertTrue(all(s.duration >= 0 for s in instrument.stages))
+        self.assertRegex(instrument.server_timing().split(', ')[0], 
+                r'^deserialize\.load;dur=\d+\.\d;desc="1 queries"$')
+
+        # Queries are still counted once the connection's query log is full
+        from django.db import connection, reset_queries
+        self.addCleanup(reset_queries)
+        connection.queries_log.extend([{}] * connection.queries_log.maxlen)
+        instrument = Instrument()
+        with instrument.stage('full'):
+            TestMainModel.objects.count()
+        self.assertEqual(instrument.total().queries, 1)
+
+        # Instrumenting does not change the result
+        instrument = Instrument()
+        expected = FormGroup(MainModelForm).serialize(mmodel)
+        fg = FormGroup(MainModelForm, instrument=instrument)
+        self.assertEqual(fg.serialize(mmodel), expected)
+        self.assertEqual([s.name for s in instrument.stages], 
+                ['serialize.main', 'serialize.schema', 'serialize'])
+
+class ConcurrentReadsTestCases(TransactionTestCase):
+    """ The other threads only see committed rows, hence TransactionTestCase """
+
+    def testConcurrentReads(self):
+        o2omodel = TestOneToOneModel.objects.create(bar='I am BAR')
+        mmodel = TestMainModel.objects.create(foo='I am FOO', o2o=o2omodel)
+        for i in range(3):
+            TestRelatedModel.objects.create(main_model=mmodel, baz='BAZ %d' % i)
+            TestUniqueRelatedModel.objects.create(main_model=mmodel, code='CODE %d' % i)
+        UniqueFormSet = inlineformset_factory(TestMainModel, TestUniqueRelatedModel,
+                fields=('code',), formset=DjanxInlineFormSet)
+        formsets = {RelatedModelFormSet: 'main_model', UniqueFormSet: 'main_model'}
+        fg = FormGroup(MainModelForm, formsets=formsets, inline_1to1={'o2o': OneToOneModelForm()})
+        expected = fg.serialize(fg.get_object(mmodel.pk))
+        self.assertEqual(len(expected[0]['formsets']['testuniquerelatedmodel']), 3)
+
+        # The rows of both formsets are fetched by other threads, on
+        # connections of their own
+        fg = FormGroup(MainModelForm, formsets=formsets, inline_1to1={'o2o': OneToOneModelForm()},
+                concurrent_reads=2)
+        obj = fg.get_object(mmodel.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(fg.serialize(obj), expected)
+
+        # Within a transaction the rows are fetched as usual
+        with transaction.atomic():
+            obj = fg.get_object(mmodel.pk)
+            with self.assertNumQueries(2):
+                self.assertEqual(fg.serialize(obj), expected)
+
+class ReplicaTestCases(TestCase):
+    """ Needs the 'replica' database of the test project's settings """
+    multi_db = True
+
+    def setUp(self):
+        self.o2omodel = TestOneToOneModel.objects.create(bar='I am BAR')
+        self.mmodel = TestMainModel.objects.create(foo='I am FOO', o2o=self.o2omodel)
+        TestRelatedModel.objects.create(main_model=self.mmodel, baz='I am BAZ')
+        # The replica lags behind: old values, no formset row yet, and a
+        # choice the primary no longer has
+        TestOneToOneModel.objects.using('replica').create(pk=self.o2omodel.pk, bar='OLD BAR')
+        TestMainModel.objects.using('replica').create(pk=self.mmodel.pk, foo='OLD FOO',
+                o2o_id=self.o2omodel.pk)
+        self.old_choice = TestOneToOneModel.objects.using('replica').create(bar='GONE')
+        self.addCleanup(caches[READ_YOUR_WRITES_CACHE].clear)
+
+    def testReadUsing(self):
+        fg = FormGroup(MainModelForm, formsets={RelatedModelFormSet: 'main_model'},
+                inline_1to1={'o2o': OneToOneModelForm()}, read_using='replica')
+        with self.assertNumQueries(0):
+            content, schema, order = fg.serialize(fg.get_object(self.mmodel.pk))
+        self.assertEqual((content['foo'], content['o2o']['bar']), ('OLD FOO', 'OLD BAR'))
+        self.assertEqual(content['formsets']['testrelatedmodel'], [])
+
+        class ChoiceForm(DjanxForm, forms.ModelForm):
+            class Meta:
+                model = TestMainModel
+                fields = ['foo', 'o2o']
+        content, schema, order = FormGroup(ChoiceForm, read_using='replica').serialize()
+        self.assertIn(self.old_choice.pk, [c['pk'] for c in schema['o2o']['choices']])
+        content, schema, order = FormGroup(ChoiceForm).serialize()
+        self.assertNotIn(self.old_choice.pk, [c['pk'] for c in schema['o2o']['choices']])
+
+        # Cached schemas are kept apart per database
+        self.addCleanup(invalidate_schema_cache)
+        for (read_using, expected) in [(None, False), ('replica', True)]:
+            content, schema, order = FormGroup(ChoiceForm, cache_schema=True,
+                    read_using=read_using).serialize()
+            self.assertEqual(self.old_choice.pk in [c['pk'] for c in schema['o2o']['choices']],
+                    expected)
+        page = get_choices_page(ChoiceForm.base_fields['o2o'], using='replica')
+        self.assertIn(self.old_choice.pk, [c['pk'] for c in page['choices']])
+
+    def testReadYourWrites(self):
+        writer = FormGroup(MainModelForm, inline_1to1={'o2o': OneToOneModelForm},
+                read_using='replica', read_your_writes=60)
+        with self.assertNumQueries(0, using='replica'):
+            writer.deserialize({'id': self.mmodel.pk, 'foo': 'NEW FOO', 
+                'o2o': {'id': self.o2omodel.pk, 'bar': 'NEW BAR'}})
+            self.assertTrue(writer.is_valid())
+            writer.save(commit=True)
+
+        def read(**kwargs):
+            fg = FormGroup(MainModelForm, inline_1to1={'o2o': OneToOneModelForm()}, **kwargs)
+            content, schema, order = fg.serialize(fg.get_object(self.mmodel.pk))
+            return content['foo'], content['o2o']['bar']
+        self.assertEqual(read(read_using='replica', read_your_writes=60), ('NEW FOO', 'NEW BAR'))
+        self.assertEqual(read(read_using='replica'), ('OLD FOO', 'OLD BAR'))
+        caches[READ_YOUR_WRITES_CACHE].clear() # As when read_your_writes runs out
+        self.assertEqual(read(read_using='replica', read_your_writes=60), ('OLD FOO', 'OLD BAR'))
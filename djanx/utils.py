@@ -1,6 +1,11 @@
-from itertools import chain
-from django.db import models
+from itertools import chain, islice
+import django
+from django.db import models, connections, router
+from django.db.models import Case, When, Value, prefetch_related_objects
+from django.db.models.query import QuerySet, ValuesIterable
 from django.db.models.fields import DateField
+from django.utils import dateparse
+import datetime
 import dateutil.parser
 
 def model_to_dict(instance, fields=None, exclude=None,
@@ -15,46 +20,246 @@ def model_to_dict(instance, fields=None, exclude=None,
     ``exclude`` is an optional list of field names. If provided, the named
     fields will be excluded from the returned dict, even if they are listed in
     the ``fields`` argument.
+
+    ``recurse`` maps relation field names to dicts of ``fields``, ``exclude``
+    and ``recurse`` arguments for serializing the related object(s) in place of
+    their keys.
+
+    This is a convenience wrapper around get_serializer; use that directly
+    (and its many() method) when serializing lots of instances.
+    """
+    return get_serializer(instance._meta.model, fields, exclude, recurse)(instance)
+
+_serializers = {}
+
+def get_serializer(model, fields=None, exclude=None, recurse={}):
+    """
+    Returns a ModelSerializer for the given model_to_dict arguments, compiling
+    it on first use.
+    """
+    key = (model, _freeze(fields), _freeze(exclude), _freeze(recurse))
+    try:
+        return _serializers[key]
+    except KeyError:
+        serializer = _serializers[key] = ModelSerializer(model, fields, exclude, recurse)
+        return serializer
+
+class ModelSerializer(object):
+    """
+    model_to_dict specialised for one model and one set of fields / exclude /
+    recurse arguments.  The field filtering and relation checks are done once
+    here, leaving only attribute lookups per instance.
+    """
+
+    def __init__(self, model, fields=None, exclude=None, recurse={}):
+        fields = set(fields) if fields else None
+        exclude = set(exclude) if exclude else set()
+        opts = model._meta
+
+        def wanted(f):
+            return (fields is None or f.name in fields) and f.name not in exclude
+
+        def sub_serializer(f):
+            return get_serializer(f.related_model,
+                    fields=recurse[f.name].get('fields', None),
+                    exclude=recurse[f.name].get('exclude', None),
+                    recurse=recurse[f.name].get('recurse', {}))
+
+        names = []      # All of the below, in field order
+        attributes = [] # (name, attname): value is a plain attribute
+        getters = []    # (name, field): value needs field.value_from_object
+        related = []    # (name, serializer): recurse into a forward relation
+        for f in chain(opts.concrete_fields, opts.private_fields):
+            if not wanted(f):
+                continue
+            names.append(f.name)
+            if f.is_relation and f.name in recurse:
+                related.append((f.name, sub_serializer(f)))
+            elif (isinstance(f, models.Field) and 
+                    type(f).value_from_object is models.Field.value_from_object):
+                attributes.append((f.name, f.attname))
+            else:
+                getters.append((f.name, f))
+
+        many_to_many = [] # (name, field, serializer or None)
+        for f in opts.many_to_many:
+            if not wanted(f):
+                continue
+            names.append(f.name)
+            many_to_many.append((f.name, f, sub_serializer(f) if f.name in recurse else None))
+
+        self.model = model
+        self.names = tuple(names)
+        self.attributes = tuple(attributes)
+        self.getters = tuple(getters)
+        self.related = tuple(related)
+        self.many_to_many = tuple(many_to_many)
+        # Flat serializers can be fed straight from QuerySet.values()
+        self.flat = not (getters or related or many_to_many)
+
+    def __call__(self, instance):
+        data = {name: getattr(instance, attname) for (name, attname) in self.attributes}
+        for (name, f) in self.getters:
+            data[name] = f.value_from_object(instance)
+        for (name, serializer) in self.related:
+            obj = getattr(instance, name)
+            data[name] = serializer(obj) if obj is not None else None
+        for (name, f, serializer) in self.many_to_many:
+            if serializer is None:
+                data[name] = [obj.pk for obj in f.value_from_object(instance)]
+            else:
+                data[name] = [serializer(obj) for obj in f.value_from_object(instance)]
+        return data
+
+    def many(self, objs):
+        """
+        Serializes a list of instances, a queryset, or a values() queryset.
+
+        An unevaluated queryset is fetched with values() when the serializer is
+        flat, which skips creating model instances altogether.
+        """
+        if isinstance(objs, QuerySet) and objs._result_cache is None and self.flat:
+            if not issubclass(objs._iterable_class, ValuesIterable):
+                objs = objs.values(*[name for (name, _) in self.attributes])
+            return [{name: row[name] for (name, _) in self.attributes} for row in objs]
+        return [self(obj) for obj in objs]
+
+    def columns(self, first=()):
+        """
+        The names of the serialized fields, starting with those in first (e.g.
+        a form's fields) in that order, for use with row() and many_rows().
+        """
+        first = [name for name in first if name in self.names]
+        return first + [name for name in self.names if name not in first]
+
+    def row(self, instance, columns):
+        """
+        Serializes instance as a list of values in the order of columns.
+        """
+        data = self(instance)
+        return [data[name] for name in columns]
+
+    def many_rows(self, objs, columns):
+        """
+        Like many, but returns a list of values in the order of columns for
+        each instance.  Unevaluated querysets of a flat serializer are fetched
+        with values_list().
+        """
+        if (isinstance(objs, QuerySet) and objs._result_cache is None and self.flat 
+                and not issubclass(objs._iterable_class, ValuesIterable)):
+            return [list(row) for row in objs.values_list(*columns)]
+        return [[data[name] for name in columns] for data in self.many(objs)]
+
+def _freeze(value):
     """
-    opts = instance._meta
-    data = {}
+    Turns model_to_dict arguments into something hashable.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for (k, v) in value.items()))
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return frozenset(value)
+    return value
+
+def plan_related(model, fields=None, exclude=None, recurse={}, prefix=''):
+    """
+    Works out the related lookups needed to run model_to_dict (with the same
+    arguments) over instances of model without a query per instance.
+
+    Returns:
+        tuple: (select_related, prefetch_related), lists of lookups suitable for
+        the QuerySet methods of the same names (or prefetch_related_objects).
+        Forward relations that are recursed into are joined; many-to-many
+        relations are prefetched.
+    """
+    opts = model._meta
+    select_related = []
+    prefetch_related = []
     for f in chain(opts.concrete_fields, opts.private_fields):
-        #if not getattr(f, 'editable', False):
-            #continue
         if fields and f.name not in fields:
             continue
         if exclude and f.name in exclude:
             continue
-
-        if f.is_relation:
-            if f.name in recurse:
-                data[f.name] = model_to_dict(f.value_from_object(instance), 
-                        fields=recurse[f.name].get('fields', None),
-                        exclude=recurse[f.name].get('exclude', None),
-                        recurse=recurse[f.name].get('recurse', {}))
-            else:
-                data[f.name] = f.value_from_object(instance)
-        else:
-            data[f.name] = f.value_from_object(instance)
-
+        if f.is_relation and f.name in recurse:
+            select_related.append(prefix + f.name)
+            sub_select, sub_prefetch = plan_related(f.related_model, 
+                    fields=recurse[f.name].get('fields', None),
+                    exclude=recurse[f.name].get('exclude', None),
+                    recurse=recurse[f.name].get('recurse', {}),
+                    prefix=prefix + f.name + '__')
+            select_related.extend(sub_select)
+            prefetch_related.extend(sub_prefetch)
 
     for f in opts.many_to_many:
-        #if not getattr(f, 'editable', False):
-            #continue
         if fields and f.name not in fields:
             continue
         if exclude and f.name in exclude:
             continue
+        prefetch_related.append(prefix + f.name)
         if f.name in recurse:
-            data[f.name] = [model_to_dict(obj,
+            # Joins below a prefetched relation become part of the prefetch.
+            sub_select, sub_prefetch = plan_related(f.related_model, 
                     fields=recurse[f.name].get('fields', None),
                     exclude=recurse[f.name].get('exclude', None),
-                    recurse=recurse[f.name].get('recurse', {}))
-                    for obj in f.value_from_object(instance)]
-        else:
-            data[f.name] = [obj.pk for obj in f.value_from_object(instance)]
+                    recurse=recurse[f.name].get('recurse', {}),
+                    prefix=prefix + f.name + '__')
+            prefetch_related.extend(sub_select + sub_prefetch)
+
+    return select_related, prefetch_related
 
-    return data
+def iter_chunks(queryset, chunk_size):
+    """
+    Iterates over queryset without caching the results on it, yielding lists
+    of up to chunk_size instances.  The queryset's prefetch_related lookups
+    are applied to each list, since iterator() on its own ignores them.
+    """
+    if django.VERSION >= (2, 0):
+        objs = queryset.iterator(chunk_size=chunk_size)
+    else:
+        objs = queryset.iterator()
+    lookups = queryset._prefetch_related_lookups
+    while True:
+        chunk = list(islice(objs, chunk_size))
+        if not chunk:
+            return
+        if lookups:
+            prefetch_related_objects(chunk, *lookups)
+        yield chunk
+
+def bulk_update(model, objs, fields, batch_size=None):
+    """
+    Updates the given fields of objs with one UPDATE per batch, like
+    QuerySet.bulk_update (which this uses when Django provides it).
+
+    Like QuerySet.update, this sends no pre_save / post_save signals and does
+    not call save().
+
+    Args:
+        model (Model subclass): the model of objs.
+
+        objs (list): saved instances of model.
+
+        fields (list): names of the fields to update.
+    """
+    objs = list(objs)
+    if not objs or not fields:
+        return
+    manager = model._default_manager
+    if hasattr(manager, 'bulk_update'):
+        manager.bulk_update(objs, fields, batch_size=batch_size)
+        return
+
+    fields = [model._meta.get_field(name) for name in fields]
+    db = router.db_for_write(model)
+    max_batch_size = max(connections[db].ops.bulk_batch_size(['pk'] + ['pk', 'pk'] * len(fields), objs), 1)
+    batch_size = min(batch_size, max_batch_size) if batch_size else max_batch_size
+    for start in range(0, len(objs), batch_size):
+        batch = objs[start:start+batch_size]
+        updates = {}
+        for f in fields:
+            whens = [When(pk=obj.pk, then=Value(getattr(obj, f.attname), output_field=f))
+                    for obj in batch]
+            updates[f.name] = Case(*whens, output_field=f)
+        manager.using(db).filter(pk__in=[obj.pk for obj in batch]).update(**updates)
 
 def dict_to_model(cls, data):
     """
@@ -80,8 +285,26 @@ def dict_to_model(cls, data):
         if f.is_relation and not isinstance(val, models.Model):
             mdata[f.name+"_id"] = val
         elif val and isinstance(f, DateField):
-            mdata[f.name] = dateutil.parser.parse(val)
+            mdata[f.name] = parse_iso_datetime(val)
         else:
             mdata[f.name] = val
 
     return cls(**mdata)
+
+def parse_iso_datetime(value):
+    """
+    Parses a date or datetime string into a datetime, as dateutil.parser.parse
+    would.  The ISO 8601 shapes the frontend sends ('2017-03-01',
+    '2017-03-01T12:30:00.000Z' from toISOString, with or without an offset)
+    are parsed directly; anything else falls back to the much slower lenient
+    dateutil parser.
+
+    Raises ValueError for strings that cannot be parsed.
+    """
+    result = dateparse.parse_datetime(value)
+    if result is not None:
+        return result
+    date = dateparse.parse_date(value)
+    if date is not None:
+        return datetime.datetime(date.year, date.month, date.day)
+    return dateutil.parser.parse(value)